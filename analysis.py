@@ -0,0 +1,187 @@
+##################################################################
+## ANALYSIS - lazy metrics over many recorded runs
+##################################################################
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from numpy import array, concatenate, cross, diff, sqrt, zeros, einsum
+from numpy.linalg import solve
+
+from recording import open_run, META_NAME, TIMES_NAME, STEPS_NAME, POSITIONS_NAME, VELOCITIES_NAME
+
+INDEX_NAME = "index.json"
+CHUNK_FRAMES = 4096  # frames read into memory at once
+
+
+def change_in_sign(first, second):
+    """Vectorized plotting.change_in_sign."""
+    same = ((first > 0) & (second > 0)) | ((first < 0) & (second < 0))
+    return ~same & ~((first == 0) & (second == 0))
+
+
+def spin_z(positions, velocities, masses):
+    """Angular velocity about z of the best rigid fit to each frame of a chunk."""
+    total = masses.sum()
+    rcom = einsum("p,fpi->fi", masses, positions) / total
+    vcom = einsum("p,fpi->fi", masses, velocities) / total
+    offsets = positions - rcom[:, None, :]
+
+    spin = einsum("p,fpi->fi", masses, cross(offsets, velocities - vcom[:, None, :]))
+    inertia = (einsum("p,fpi,fpi->f", masses, offsets, offsets)[:, None, None] * array(
+        [[1.0, 0, 0], [0, 1, 0], [0, 0, 1]]) - einsum("p,fpi,fpj->fij", masses, offsets, offsets))
+
+    return solve(inertia, spin[:, :, None])[:, 2, 0]
+
+
+def summarize_run(directory, chunk=CHUNK_FRAMES):
+    """
+    Compute the launch metrics of a recorded run, reading it in chunks.
+
+    The contact time follows main_loop: the times at which the slope of the
+    center particle's speed changes sign, each stamped with the time before
+    the step that revealed it, with the collision lasting from the first
+    change to the second. Slopes are taken between recorded frames, so a
+    record stride above 1 resolves them more coarsely. The spin is the mean
+    rigid-fit angular velocity about z once six changes have passed, where
+    main_loop starts measuring it, or the rigid fit of the final frame when
+    the center particle stopped oscillating first, as it does once --rigid
+    collapses the ball. Peak compression is the largest relative shortening
+    of the ball along the club normal.
+
+    Returns:
+        Dict with frames, collision, average_diff, vcom, speed, omega, compression
+    """
+    run = open_run(directory)
+    meta = run['meta']
+    frames = len(run['times'])
+    summary = {'frames': frames, 'collision': None, 'average_diff': None, 'vcom': None,
+               'speed': None, 'omega': None, 'compression': None}
+    if frames == 0:
+        return summary
+
+    masses = array(meta['masses'])
+    normal = array(meta['club_norm'])
+    normal /= sqrt((normal ** 2).sum())
+
+    # main_loop stamps each step with the time before it was taken
+    times = array(run['times']) - array(run['steps'])
+
+    speeds = []
+    extents = []
+    for start in range(0, frames, chunk):
+        positions = array(run['positions'][start:start + chunk])
+        center = array(run['velocities'][start:start + chunk, meta['center']])
+        speeds.append(sqrt((center ** 2).sum(axis=1)))
+
+        depths = positions @ normal
+        extents.append(depths.max(axis=1) - depths.min(axis=1))
+    speeds = concatenate(speeds)
+    extents = concatenate(extents)
+
+    slopes = diff(speeds)
+    flips = 2 + change_in_sign(slopes[:-1], slopes[1:]).nonzero()[0]
+    changes = times[flips]
+    if len(changes) > 1:
+        summary['collision'] = float(changes[1] - changes[0])
+    if len(changes) > 2:
+        summary['average_diff'] = float(diff(changes[1:]).mean())
+
+    if len(changes) > 5:
+        spins = zeros(0)
+        for start in range(int(flips[5]) + 1, frames, chunk):
+            spins = concatenate((spins, spin_z(array(run['positions'][start:start + chunk]),
+                                               array(run['velocities'][start:start + chunk]), masses)))
+        if len(spins) > 0:
+            summary['omega'] = float(spins.mean())
+
+    last = array(run['velocities'][-1])
+    if summary['omega'] is None:
+        summary['omega'] = float(spin_z(array(run['positions'][-1:]), last[None], masses)[0])
+
+    vcom = (masses[:, None] * last).sum(axis=0) / masses.sum()
+    summary['vcom'] = [float(value) for value in vcom]
+    summary['speed'] = float(sqrt((vcom ** 2).sum()))
+    summary['compression'] = float(1 - extents.min() / extents[0])
+
+    return summary
+
+
+def fingerprint(directory):
+    """Sizes and modification times of a run's files, to tell when a summary is stale."""
+    return [[os.path.getsize(path), os.path.getmtime(path)]
+            for path in (os.path.join(directory, name)
+                         for name in (META_NAME, TIMES_NAME, STEPS_NAME, POSITIONS_NAME, VELOCITIES_NAME))]
+
+
+def summarize_runs(root, workers=None, chunk=CHUNK_FRAMES):
+    """
+    Summarize every run recorded under root, in parallel across runs.
+
+    Summaries are kept in an index file under root and only recomputed for
+    runs whose files changed since they were indexed.
+
+    Returns:
+        Dict of run name to summary, with the run's settings included
+    """
+    index_path = os.path.join(root, INDEX_NAME)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+
+    names = sorted(name for name in os.listdir(root)
+                   if os.path.exists(os.path.join(root, name, META_NAME)))
+    fingerprints = {name: fingerprint(os.path.join(root, name)) for name in names}
+    stale = [name for name in names
+             if name not in index or index[name]['fingerprint'] != fingerprints[name]]
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = pool.map(summarize_run, [os.path.join(root, name) for name in stale],
+                                 [chunk] * len(stale))
+            for name, summary in zip(stale, summaries):
+                with open(os.path.join(root, name, META_NAME)) as meta_file:
+                    summary['settings'] = json.load(meta_file)['settings']
+                index[name] = {'fingerprint': fingerprints[name], 'summary': summary}
+        index = {name: index[name] for name in names}
+
+        # write then rename, so a concurrent report never reads a partial index
+        with open(index_path + ".tmp", "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(index_path + ".tmp", index_path)
+
+    return {name: index[name]['summary'] for name in names}
+
+
+def parse_analysis_args():
+    """Parse command-line arguments for a report over recorded runs."""
+    parser = argparse.ArgumentParser(
+        description="Report launch metrics over recorded runs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("root", type=str, help="Directory holding one subdirectory per recorded run")
+    parser.add_argument("--workers", type=int, default=None, help="Runs summarized in parallel")
+    parser.add_argument("--chunk", type=int, default=CHUNK_FRAMES, help="Frames read into memory at once")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_analysis_args()
+    summaries = summarize_runs(args.root, args.workers, args.chunk)
+
+    print("%-24s %8s %8s %12s %10s %10s %12s"
+          % ("run", "velocity", "loft", "collision", "speed", "omega", "compression"))
+    for name, summary in summaries.items():
+        settings = summary['settings']
+        print("%-24s %8.2f %8.2f %12s %10s %10s %12s"
+              % (name, settings['club_velocity'], settings['loft'],
+                 *("-" if summary[key] is None else "%.4g" % summary[key]
+                   for key in ('collision', 'speed', 'omega', 'compression'))))
+
+
+if __name__ == '__main__':
+    main()
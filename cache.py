@@ -0,0 +1,67 @@
+##################################################################
+## RESULT CACHE - persistent impact results keyed by configuration
+##################################################################
+
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+import constants
+
+# Config fields that do not change the outcome of an impact
+DISPLAY_FIELDS = ("debug", "width", "height", "monitor", "monitor_file", "energy_alarm", "momentum_alarm",
+                  "export", "export_stride", "record", "record_stride")
+
+# constants that do, so editing constants.py invalidates old results
+MODEL_CONSTANTS = ("DAMPING", "TIMESTEP", "RIGID_TIMESTEP", "SEPARATION_STEPS", "IMPACT_DURATION",
+                   "DEFAULT_NEIGHBOR_MODULUS", "DEFAULT_LAYER_MODULUS",
+                   "NEIGHBOR_TOLERANCE", "CONTACT_TOLERANCE")
+
+
+def get_settings(config):
+    """Get the Config fields that determine the outcome of an impact."""
+    return {name: value for name, value in asdict(config).items() if name not in DISPLAY_FIELDS}
+
+
+def config_key(config):
+    """Hash the physical settings of a Config into a stable cache key."""
+    model = {name: getattr(constants, name) for name in MODEL_CONSTANTS}
+    model['particle_mass'] = config.particle_mass
+    text = json.dumps({'settings': get_settings(config), 'constants': model}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """Directory of JSON impact results, one file per configuration key."""
+
+    def __init__(self, directory=constants.CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Get the cached result for key, or None."""
+        try:
+            with open(self.path(key)) as cached:
+                return json.load(cached)['result']
+        except FileNotFoundError:
+            return None
+
+    def entries(self):
+        """Yield the key, settings and result of every cached impact."""
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as cached:
+                    entry = json.load(cached)
+                yield name[:-len(".json")], entry['settings'], entry['result']
+
+    def put(self, key, config, result):
+        """Store the result of running config under key."""
+        # write then rename, so concurrent readers never see a partial file
+        temporary = self.path(key) + "." + str(os.getpid())
+        with open(temporary, "w") as cached:
+            json.dump({'settings': get_settings(config), 'result': result}, cached)
+        os.replace(temporary, self.path(key))
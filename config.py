@@ -4,7 +4,7 @@
 
 import argparse
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 from vpython import vector
 from numpy import linspace
@@ -17,6 +17,24 @@ class Config:
     # Simulation parameters (from CLI)
     club_velocity: float
     loft: float
+    rigid: bool
+    keep_vibration: bool
+    substeps: int
+    refine: int
+    patch_angle: float
+    symmetric: bool
+
+    # Diagnostics (from CLI)
+    monitor: int
+    monitor_file: Optional[str]
+    energy_alarm: float
+    momentum_alarm: float
+
+    # Export (from CLI)
+    export: Optional[str]
+    export_stride: int
+    record: Optional[str]
+    record_stride: int
 
     # Visualization options (from CLI)
     debug: bool
@@ -29,10 +47,15 @@ class Config:
     pieces: int
 
     # Derived properties
+    @property
+    def particle_count(self) -> int:
+        """Particles in the uniform model: a geodesic shell per piece around a center particle."""
+        return 1 + sum(10 * 4 ** layer + 2 for layer in range(self.pieces))
+
     @property
     def particle_mass(self) -> float:
-        """Mass per particle (ball divided into 217 particles)."""
-        return self.ball_mass / 217
+        """Mass per particle, so the uniform model weighs ball_mass at any resolution."""
+        return self.ball_mass / self.particle_count
 
     @property
     def particle_radius(self) -> float:
@@ -89,8 +112,8 @@ class Config:
         return DEFAULT_LAYER_MODULUS
 
 
-def parse_args() -> argparse.Namespace:
-    """Parse command-line arguments."""
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command-line arguments (sys.argv unless argv is given)."""
     parser = argparse.ArgumentParser(
         description="Golf Ball Deformation Simulation - VPython particle-spring model",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -108,6 +131,86 @@ def parse_args() -> argparse.Namespace:
         type=float, default=0,
         help="Club loft angle in degrees"
     )
+    sim_group.add_argument(
+        "--rigid",
+        action="store_true", default=False,
+        help="Collapse the ball into a rigid body once it leaves the club face"
+    )
+    sim_group.add_argument(
+        "--keep-vibration",
+        action="store_true", default=False,
+        help="Carry residual vibration through rigid-body flight"
+    )
+    sim_group.add_argument(
+        "--substeps",
+        type=int, default=1,
+        help="Fine steps of the stiff intra-shell springs and club contact per "
+             "coarse step of the nested springs (1 disables multi-rate, at most 3). "
+             "At 3 the golden shots run 1.0-1.3x faster and land within 0.5%% in "
+             "launch speed and spin and 5%% in contact time"
+    )
+    sim_group.add_argument(
+        "--refine",
+        type=int, default=1,
+        help="Refine the outer shell by this factor where it faces the club (1 disables)"
+    )
+    sim_group.add_argument(
+        "--patch-angle",
+        type=float, default=90.0,
+        help="Half-angle in degrees of the refined patch around the club direction; "
+             "the club holds particles up to about 50 degrees out"
+    )
+    sim_group.add_argument(
+        "--symmetric",
+        action="store_true", default=False,
+        help="Simulate only half the ball when the impact is symmetric about z = 0"
+    )
+
+    # Diagnostics
+    diag_group = parser.add_argument_group("Diagnostics")
+    diag_group.add_argument(
+        "--monitor",
+        type=int, default=0, metavar="N",
+        help="Report energy and momentum budgets every N steps (0 disables)"
+    )
+    diag_group.add_argument(
+        "--monitor-file",
+        type=str, default=None,
+        help="Write the budget stream to this file instead of stdout"
+    )
+    diag_group.add_argument(
+        "--energy-alarm",
+        type=float, default=5e-2,
+        help="Relative energy drift that raises an alarm"
+    )
+    diag_group.add_argument(
+        "--momentum-alarm",
+        type=float, default=1e-3,
+        help="Relative momentum drift that raises an alarm"
+    )
+
+    # Export
+    export_group = parser.add_argument_group("Export")
+    export_group.add_argument(
+        "--export",
+        type=str, default=None, metavar="DIR",
+        help="Write the particles and springs to DIR as a VTK time series"
+    )
+    export_group.add_argument(
+        "--export-stride",
+        type=int, default=10, metavar="N",
+        help="Export every N steps"
+    )
+    export_group.add_argument(
+        "--record",
+        type=str, default=None, metavar="DIR",
+        help="Record the particle states to DIR for analysis.py"
+    )
+    export_group.add_argument(
+        "--record-stride",
+        type=int, default=1, metavar="N",
+        help="Record every N steps"
+    )
 
     # Visualization options
     vis_group = parser.add_argument_group("Visualization Options")
@@ -127,7 +230,12 @@ def parse_args() -> argparse.Namespace:
         help="Canvas height in pixels"
     )
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    from constants import MAX_SUBSTEPS
+    if not 1 <= args.substeps <= MAX_SUBSTEPS:
+        parser.error("--substeps must be between 1 and " + str(MAX_SUBSTEPS))
+
+    return args
 
 
 def create_config(args: argparse.Namespace = None) -> Config:
@@ -140,6 +248,20 @@ def create_config(args: argparse.Namespace = None) -> Config:
     return Config(
         club_velocity=args.club_velocity,
         loft=args.loft,
+        rigid=args.rigid,
+        keep_vibration=args.keep_vibration,
+        substeps=args.substeps,
+        refine=args.refine,
+        patch_angle=args.patch_angle,
+        symmetric=args.symmetric,
+        monitor=args.monitor,
+        monitor_file=args.monitor_file,
+        energy_alarm=args.energy_alarm,
+        momentum_alarm=args.momentum_alarm,
+        export=args.export,
+        export_stride=args.export_stride,
+        record=args.record,
+        record_stride=args.record_stride,
         debug=args.debug,
         width=args.width,
         height=args.height,
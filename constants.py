@@ -20,6 +20,22 @@ DAMPING = 0.78
 TIMESTEP = 1e-6  # seconds
 PIECES = 2
 
+# rigid-body flight after the ball leaves the club face
+RIGID_TIMESTEP = 1e-4  # seconds
+SEPARATION_STEPS = 10  # consecutive contact-free steps before collapsing
+
+# multi-rate integration; beyond this many fine steps per coarse step the
+# spin of the golden shots drifts by several percent
+MAX_SUBSTEPS = 3
+
+# headless runs
+IMPACT_DURATION = 1e-3  # seconds simulated per impact
+CACHE_DIR = "cache"  # results of headless runs
+SERVER_PORT = 8160
+
+# reduced-order modal model
+MODAL_MODES = 100  # vibration modes kept besides the contact corrections; the step costs the same for any count
+
 # spring modulus values
 DEFAULT_NEIGHBOR_MODULUS = [2.94e8, 3.92e8, 3.92e8]
 DEFAULT_LAYER_MODULUS = [3.92e7, 3.92e7, 3.92e7]
@@ -0,0 +1,158 @@
+##################################################################
+## DIAGNOSTICS - energy and momentum budgets
+##################################################################
+
+import sys
+
+from numpy import array, cross, sqrt
+from numpy.linalg import norm
+
+from constants import DAMPING
+
+COLUMNS = ["step", "t", "kinetic", "potential", "damped", "energy_drift",
+           "px", "py", "pz", "momentum_drift", "angular_drift"]
+
+
+def spring_edges(particles):
+    """Get index, rest length and constant arrays with one entry per spring."""
+    first = []
+    second = []
+    rest = []
+    constant = []
+
+    # every spring is stored on both of its particles, so keep the copy on the lower index
+    for index, particle in enumerate(particles):
+        for spring in particle.springs:
+            if spring.neighbor > index:
+                first.append(index)
+                second.append(spring.neighbor)
+                rest.append(spring.rest)
+                constant.append(spring.constant)
+
+    return {
+        'first': array(first, dtype=int),
+        'second': array(second, dtype=int),
+        'rest': array(rest),
+        'constant': array(constant),
+    }
+
+
+def get_state(particles):
+    """Get position and velocity arrays of shape [num_particles, 3]."""
+    positions = array([(particle.pos.x, particle.pos.y, particle.pos.z) for particle in particles])
+    velocities = array([(particle.velocity.x, particle.velocity.y, particle.velocity.z) for particle in particles])
+
+    return positions, velocities
+
+
+def get_budget(positions, velocities, masses, edges):
+    """
+    Compute the energy and momentum of the particle model.
+
+    DAMPING scales every spring force uniformly, which makes each spring behave
+    like a softer one of constant DAMPING * k. The potential energy is stored in
+    those effective springs, and 'damped' is the part of the nominal spring
+    energy that DAMPING withholds from the particles.
+
+    Returns:
+        Dict with kinetic, potential, damped, momentum, angular
+    """
+    stretch = norm(positions[edges['first']] - positions[edges['second']], axis=1) - edges['rest']
+    nominal = (edges['constant'] * stretch ** 2).sum() / 2
+    momenta = masses[:, None] * velocities
+
+    return {
+        'kinetic': (momenta * velocities).sum() / 2,
+        'potential': DAMPING * nominal,
+        'damped': (1 - DAMPING) * nominal,
+        'momentum': momenta.sum(axis=0),
+        'angular': cross(positions, momenta).sum(axis=0),
+    }
+
+
+class ConservationMonitor:
+    """
+    Track the energy and momentum budgets of the particle model every N steps.
+
+    The springs only move energy and momentum between particles, so whatever
+    change the club's work and impulse, as update_club and credit_snaps total
+    them on the club, do not account for is integrator drift, however often
+    it is sampled. Drift is measured against the kinetic energy and momentum the
+    ball would carry at the club's speed, or the club's work and impulse so
+    far if larger, so that the alarms do not fire on the small budgets early
+    in contact. The largest relative drifts seen are kept in peaks.
+    """
+
+    def __init__(self, particles, every, stream=None, energy_alarm=5e-2, momentum_alarm=1e-3):
+        self.every = every
+        self.stream = stream if stream is not None else sys.stdout
+        self.energy_alarm = energy_alarm
+        self.momentum_alarm = momentum_alarm
+        self.masses = array([particle.mass for particle in particles])
+        self.edges = spring_edges(particles)
+        self.steps = 0
+        self.first = None
+        self.energy_scale = 0
+        self.momentum_scale = 0
+        self.alarms = set()
+        self.peaks = {'energy': 0.0, 'momentum': 0.0}
+
+        self.stream.write("# " + " ".join(COLUMNS) + "\n")
+
+    def sample(self, particles, club, t):
+        """Record one step, writing a line to the stream every N steps."""
+        self.steps += 1
+        if self.first is not None and self.steps % self.every != 0:
+            return None
+
+        budget = get_budget(*get_state(particles), self.masses, self.edges)
+        energy = budget['kinetic'] + budget['potential']
+        totals = {
+            'work': club.work,
+            'impulse': array([club.impulse.x, club.impulse.y, club.impulse.z]),
+            'angular_impulse': array([club.angular_impulse.x, club.angular_impulse.y, club.angular_impulse.z]),
+        }
+
+        if self.first is None:
+            self.first = dict(budget, energy=energy, **totals)
+            speed = sqrt(club.velocity.x ** 2 + club.velocity.y ** 2 + club.velocity.z ** 2)
+            self.energy_scale = self.masses.sum() * speed ** 2 / 2
+            self.momentum_scale = self.masses.sum() * speed
+
+        club_work = totals['work'] - self.first['work']
+        club_impulse = totals['impulse'] - self.first['impulse']
+        club_angular_impulse = totals['angular_impulse'] - self.first['angular_impulse']
+
+        energy_drift = energy - self.first['energy'] - club_work
+        momentum_drift = sqrt(((budget['momentum'] - self.first['momentum'] - club_impulse) ** 2).sum())
+        angular_drift = sqrt(((budget['angular'] - self.first['angular'] - club_angular_impulse) ** 2).sum())
+
+        energy_scale = max(self.energy_scale, abs(club_work))
+        momentum_scale = max(self.momentum_scale, sqrt((club_impulse ** 2).sum()))
+        self.check_alarm("energy", energy_drift, energy_scale, self.energy_alarm, t)
+        self.check_alarm("momentum", momentum_drift, momentum_scale, self.momentum_alarm, t)
+
+        row = [budget['kinetic'], budget['potential'], budget['damped'], energy_drift,
+               *budget['momentum'], momentum_drift, angular_drift]
+        self.stream.write(str(self.steps) + " " + "%.9g" % t + " "
+                          + " ".join("%.6e" % value for value in row) + "\n")
+
+        return {
+            'energy_drift': energy_drift,
+            'momentum_drift': momentum_drift,
+            'angular_drift': angular_drift,
+        }
+
+    def check_alarm(self, name, drift, scale, threshold, t):
+        """Warn once each time a relative drift crosses its threshold."""
+        if scale == 0:
+            return
+
+        self.peaks[name] = max(self.peaks[name], abs(drift) / scale)
+        if abs(drift) / scale > threshold:
+            if name not in self.alarms:
+                self.alarms.add(name)
+                print("ALARM t = " + str(t) + ": " + name + " drift " + str(drift)
+                      + " exceeds " + str(threshold) + " of " + str(scale), file=sys.stderr)
+        else:
+            self.alarms.discard(name)
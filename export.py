@@ -0,0 +1,97 @@
+##################################################################
+## EXPORT - stream the deformation to ParaView-readable VTK files
+##################################################################
+
+import base64
+import os
+import zlib
+
+from numpy import arange, ascontiguousarray, column_stack, uint32
+
+from diagnostics import spring_edges, get_state
+
+BLOCK_SIZE = 1 << 15  # bytes per independently compressed block
+COMPRESSION_LEVEL = 6
+COLLECTION_NAME = "impact.pvd"
+
+
+def encode(values, dtype):
+    """Encode an array as zlib-compressed, base64 VTK binary data."""
+    raw = ascontiguousarray(values, dtype=dtype).tobytes()
+    blocks = [raw[start:start + BLOCK_SIZE] for start in range(0, len(raw), BLOCK_SIZE)]
+    compressed = [zlib.compress(block, COMPRESSION_LEVEL) for block in blocks]
+
+    last = len(blocks[-1]) if blocks else 0
+    header = [len(blocks), BLOCK_SIZE, last] + [len(block) for block in compressed]
+
+    # the header and the blocks are base64 encoded separately
+    return (base64.b64encode(ascontiguousarray(header, dtype=uint32).tobytes()).decode()
+            + base64.b64encode(b"".join(compressed)).decode())
+
+
+def data_array(name, dtype, components, data):
+    """Format one binary DataArray element."""
+    return ('<DataArray type="' + dtype + '" Name="' + name + '" NumberOfComponents="'
+            + str(components) + '" format="binary">' + data + '</DataArray>\n')
+
+
+class VTKExporter:
+    """
+    Write particle positions and the spring network as a VTK time series.
+
+    Every stride-th step becomes one compressed PolyData (.vtp) frame holding
+    the particle positions and velocities, with each spring drawn once as a
+    line. The frames are listed in a .pvd collection, so ParaView can play the
+    run back without the simulator. The collection is completed by close().
+    """
+
+    def __init__(self, directory, particles, stride):
+        self.directory = directory
+        self.stride = stride
+        self.steps = 0
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # the springs never change, so their lines are encoded once
+        edges = spring_edges(particles)
+        self.lines = len(edges['first'])
+        self.connectivity = encode(column_stack((edges['first'], edges['second'])).ravel(), "<i4")
+        self.offsets = encode(2 * arange(1, self.lines + 1), "<i4")
+
+        self.collection = open(os.path.join(directory, COLLECTION_NAME), "w")
+        self.collection.write('<?xml version="1.0"?>\n'
+                              '<VTKFile type="Collection" version="0.1" byte_order="LittleEndian">\n'
+                              '<Collection>\n')
+
+    def write(self, particles, t):
+        """Record one step, writing a frame every stride steps."""
+        self.steps += 1
+        if (self.steps - 1) % self.stride != 0:
+            return
+
+        name = "frame_%06d.vtp" % self.frames
+        self.write_frame(os.path.join(self.directory, name), *get_state(particles))
+        self.collection.write('<DataSet timestep="%.9g" part="0" file="%s"/>\n' % (t, name))
+        self.collection.flush()
+        self.frames += 1
+
+    def write_frame(self, path, positions, velocities):
+        with open(path, "w") as frame:
+            frame.write('<?xml version="1.0"?>\n'
+                        '<VTKFile type="PolyData" version="1.0" byte_order="LittleEndian" '
+                        'header_type="UInt32" compressor="vtkZLibDataCompressor">\n'
+                        '<PolyData>\n')
+            frame.write('<Piece NumberOfPoints="' + str(len(positions)) + '" NumberOfVerts="0" NumberOfLines="'
+                        + str(self.lines) + '" NumberOfStrips="0" NumberOfPolys="0">\n')
+            frame.write('<PointData Vectors="velocity">\n')
+            frame.write(data_array("velocity", "Float32", 3, encode(velocities, "<f4")))
+            frame.write('</PointData>\n<Points>\n')
+            frame.write(data_array("position", "Float32", 3, encode(positions, "<f4")))
+            frame.write('</Points>\n<Lines>\n')
+            frame.write(data_array("connectivity", "Int32", 1, self.connectivity))
+            frame.write(data_array("offsets", "Int32", 1, self.offsets))
+            frame.write('</Lines>\n</Piece>\n</PolyData>\n</VTKFile>\n')
+
+    def close(self):
+        self.collection.write('</Collection>\n</VTKFile>\n')
+        self.collection.close()
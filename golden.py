@@ -0,0 +1,258 @@
+##################################################################
+## GOLDEN - compare fast engines against the reference model
+##################################################################
+
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import replace
+
+from numpy import array, arange, interp, load, savez, sqrt
+
+from cache import config_key
+from constants import CACHE_DIR
+from diagnostics import get_state
+from headless import headless_config, run_impact
+from modal import run_modal
+
+# canonical shots the engines are checked on
+SHOTS = {
+    'driver': {'club_velocity': 64.82, 'loft': 0.0},
+    'iron': {'club_velocity': 50.0, 'loft': 20.0},
+    'wedge': {'club_velocity': 35.0, 'loft': 45.0},
+}
+
+# Config overrides of each engine; None marks engines with their own run function
+ENGINES = {
+    'multirate': {'substeps': 3},
+    'rigid': {'rigid': True},
+    'symmetric': {'symmetric': True},
+    'refined': {'refine': 2},
+    'modal': None,
+}
+
+# reference models, as Config overrides of the particle model, and the engines
+# checked against a reference other than the coarse one: refining the shell
+# is meant to move the answer toward the fully refined model's
+REFERENCES = {
+    'coarse': {},
+    'fine': {'refine': 2, 'patch_angle': 180.0},
+}
+ENGINE_REFERENCES = {
+    'refined': 'fine',
+}
+
+# largest accepted relative errors, with positions relative to the ball radius
+TOLERANCES = {
+    'trajectory': 1e-2,
+    'speed': 1e-2,
+    'spin': 5e-2,
+    'contact': 5e-2,
+    'energy_drift': headless_config().energy_alarm,
+    'momentum_drift': headless_config().momentum_alarm,
+}
+
+# errors are taken relative to at least this much of a metric, since a
+# straight shot has no spin to take a relative error of
+SCALES = {
+    'spin': 100.0,  # rad/s
+}
+
+# trajectories are compared at this interval (seconds)
+SAMPLE_INTERVAL = 1e-5
+
+# particle runs are monitored every this many steps, and their peak energy
+# and momentum drifts held to the monitor's default alarms
+MONITOR_EVERY = 10
+DRIFTS = ('energy_drift', 'momentum_drift')
+
+# the rigid-fit spin of the final state and the time the club held the ball,
+# rather than main_loop's omega and collision: the plotted omega averages
+# noise on a straight shot, and the collision time is read off sign changes
+# of the center particle's acceleration, which rounding noise can move
+METRICS = ('speed', 'spin', 'contact')
+
+
+def run_recorded(config):
+    """Run one impact headlessly and monitored, recording the particle positions after every step."""
+    config = replace(config, monitor=MONITOR_EVERY, monitor_file=os.devnull,
+                     energy_alarm=float('inf'), momentum_alarm=float('inf'))
+    times = []
+    frames = []
+
+    def observe(t, particles):
+        times.append(t)
+        frames.append(get_state(particles)[0])
+
+    start = time.perf_counter()
+    metrics = run_impact(config, observe=observe)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'times': array(times),
+        'positions': array(frames),
+        'metrics': metrics,
+        'elapsed': elapsed,
+    }
+
+
+def run_reference(shot, reference, directory=CACHE_DIR, refresh=False):
+    """
+    Run one of the REFERENCES on a shot and get its golden run.
+
+    The reference is always run, so that the engines' speedups are timed in
+    the same session. Its golden file is written from this run when missing,
+    when refresh is set, or when it predates one of the METRICS.
+
+    Returns:
+        The run and the golden run, which are the same when it was just written
+    """
+    config = headless_config(**shot, **REFERENCES[reference])
+    path = os.path.join(directory, "golden_" + config_key(config) + ".npz")
+    record = run_recorded(config)
+
+    if os.path.exists(path) and not refresh:
+        golden = load(path)
+        metrics = json.loads(str(golden['metrics']))
+        if all(name in metrics for name in METRICS):
+            return record, {'times': golden['times'], 'positions': golden['positions'], 'metrics': metrics}
+
+    os.makedirs(directory, exist_ok=True)
+    savez(path, times=record['times'], positions=record['positions'], metrics=json.dumps(record['metrics']))
+
+    return record, record
+
+
+def run_engine(name, shot):
+    """Run a shot on one of the ENGINES."""
+    if ENGINES[name] is None:
+        start = time.perf_counter()
+        metrics = run_modal(headless_config(**shot))
+        elapsed = time.perf_counter() - start
+
+        # the modal model's omega is already the rigid fit of its final state
+        metrics['spin'] = metrics['omega']
+        return {'times': None, 'positions': None, 'metrics': metrics, 'elapsed': elapsed}
+
+    return run_recorded(headless_config(**shot, **ENGINES[name]))
+
+
+def trajectory_error(reference, candidate, radius):
+    """Largest particle position difference, in ball radii, at common sample times."""
+    if candidate['positions'] is None or candidate['positions'].shape[1:] != reference['positions'].shape[1:]:
+        return None
+
+    start = max(reference['times'][0], candidate['times'][0])
+    stop = min(reference['times'][-1], candidate['times'][-1])
+    samples = arange(start, stop, SAMPLE_INTERVAL)
+
+    def resample(record):
+        flat = record['positions'].reshape(len(record['times']), -1)
+        return array([interp(samples, record['times'], flat[:, column]) for column in range(flat.shape[1])]).T
+
+    difference = (resample(reference) - resample(candidate)).reshape(len(samples), -1, 3)
+    return float(sqrt((difference ** 2).sum(axis=2)).max() / radius)
+
+
+def metric_error(reference, candidate, name):
+    """Relative error of a launch metric, or None when either run lacks it."""
+    expected = reference['metrics'].get(name)
+    actual = candidate['metrics'].get(name)
+    if expected is None or actual is None:
+        return None
+
+    return abs(actual - expected) / max(abs(expected), SCALES.get(name, 0))
+
+
+def compare(reference, candidate, radius):
+    """
+    Compare a candidate run against the reference.
+
+    The trajectory is only compared between models of the same particles, and
+    the drifts only for particle runs, which are monitored, but a metric
+    missing from either run fails the comparison.
+
+    Returns:
+        Dict with the relative error of the trajectory and each metric and the
+        candidate's peak drifts (None where they cannot be compared), and
+        whether all are within TOLERANCES
+    """
+    errors = {'trajectory': trajectory_error(reference, candidate, radius)}
+    for name in METRICS:
+        errors[name] = metric_error(reference, candidate, name)
+    for name in DRIFTS:
+        errors[name] = candidate['metrics'].get(name)
+
+    passed = all(errors[name] is not None and errors[name] <= TOLERANCES[name] for name in METRICS)
+    passed = passed and all(errors[name] is None or errors[name] <= TOLERANCES[name]
+                            for name in ('trajectory',) + DRIFTS)
+    return {'errors': errors, 'passed': passed}
+
+
+def format_error(error, tolerance):
+    if error is None:
+        return "%10s" % "-"
+    return "%9.2e%s" % (error, "!" if error > tolerance else " ")
+
+
+def report(shots, engines, refresh=False):
+    """
+    Print a side by side comparison of every engine on every shot; returns True if all pass.
+
+    Each reference is listed first, checked against its golden file, and each
+    engine's speedup is measured against its reference's run in this session.
+    """
+    radius = headless_config().ball_radius
+    columns = ('trajectory',) + METRICS + DRIFTS
+    passed = True
+
+    print("%-8s %-12s %10s %10s %10s %10s %10s %10s %9s %8s  %s"
+          % ("shot", "engine", *(name.replace("_drift", "") for name in columns), "time (s)", "speedup", "result"))
+
+    def print_row(shot, name, comparison, elapsed, speedup):
+        errors = comparison['errors']
+        print("%-8s %-12s %s %s %s %s %s %s %9.2f %7.1fx  %s"
+              % (shot, name, *(format_error(errors[column], TOLERANCES[column]) for column in columns),
+                 elapsed, speedup, "PASS" if comparison['passed'] else "FAIL"))
+
+    for shot in shots:
+        references = {}
+        for reference in dict.fromkeys(ENGINE_REFERENCES.get(engine, 'coarse') for engine in engines):
+            record, golden = run_reference(SHOTS[shot], reference, refresh=refresh)
+            references[reference] = (record, golden)
+
+            comparison = compare(golden, record, radius)
+            passed = passed and comparison['passed']
+            print_row(shot, "ref:" + reference, comparison, record['elapsed'], 1.0)
+
+        for engine in engines:
+            record, golden = references[ENGINE_REFERENCES.get(engine, 'coarse')]
+            candidate = run_engine(engine, SHOTS[shot])
+            comparison = compare(golden, candidate, radius)
+            passed = passed and comparison['passed']
+            print_row(shot, engine, comparison, candidate['elapsed'], record['elapsed'] / candidate['elapsed'])
+
+    return passed
+
+
+def parse_golden_args():
+    """Parse command-line arguments for the equivalence harness."""
+    parser = argparse.ArgumentParser(
+        description="Compare fast engines against the reference particle model on canonical shots",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--shots", nargs="+", choices=sorted(SHOTS), default=sorted(SHOTS),
+                        help="Canonical shots to run")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=sorted(ENGINES),
+                        help="Engines to compare against the reference")
+    parser.add_argument("--refresh", action="store_true", default=False,
+                        help="Rerun the reference instead of reading the golden files")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_golden_args()
+    sys.exit(0 if report(args.shots, args.engines, args.refresh) else 1)
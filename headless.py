@@ -0,0 +1,170 @@
+##################################################################
+## HEADLESS - run an impact without a canvas
+##################################################################
+
+from dataclasses import replace
+
+from vpython import vector, mag
+from numpy import array, ediff1d, average
+
+from config import create_config, parse_args
+from constants import TIMESTEP, IMPACT_DURATION
+from models import Marker, Club
+from physics import get_club_plane, animate_hybrid, separated, make_symmetric, make_rigid
+from plotting import plot
+from export import VTKExporter
+from diagnostics import ConservationMonitor
+from recording import RunRecorder
+from project_geo import make_model
+
+
+def headless_config(**settings):
+    """Create a Config with the default arguments, overriding the given fields."""
+    return replace(create_config(parse_args([])), **settings)
+
+
+def reset_headless(config):
+    """Initialize the simulation state without creating any VPython objects."""
+    particles = make_model(config, visual=Marker)
+    club_visual = Marker(pos=config.club_r0, axis=vector(1, 0, 0), length=config.club_depth)
+    club = Club(club_visual, config.club_v0)
+    get_club_plane(club, config)
+    if config.symmetric:
+        make_symmetric(particles, club, config)
+
+    return {
+        'particles': particles,
+        'club': club,
+    }
+
+
+def get_metrics(changes, omegas, vcom, body=None):
+    """Summarize the tracked data the way main_loop reports it, taking the spin from body if given."""
+    collision = None
+    if len(changes) > 1:
+        collision = float(changes[1] - changes[0])
+
+    diffs = None
+    if len(changes) > 2:
+        diffs = float(average(ediff1d(changes[1:])))
+
+    omega = None
+    if body is not None:
+        omega = float(body.omega.z)
+    elif len(omegas) > 0:
+        omega = float(average(omegas))
+
+    return {
+        'collision': collision,
+        'average_diff': diffs,
+        'vcom': [vcom.x, vcom.y, vcom.z],
+        'speed': mag(vcom),
+        'omega': omega,
+    }
+
+
+def run_impact(config, duration=IMPACT_DURATION, progress=None, stop=None, observe=None):
+    """
+    Simulate one impact without graphics.
+
+    Args:
+        config: Config for the impact (rigid and substeps modes are honored)
+        duration: Simulated time in seconds
+        progress: Optional callable receiving the completed fraction of duration
+        stop: Optional callable receiving t and the plot data once the ball
+            has left the club; returning True ends the run early
+        observe: Optional callable receiving t and the particles after every step
+
+    Returns:
+        Dict with collision, average_diff, vcom, speed, omega, spin (the
+        rigid-fit spin about z of the final state), contact (time from the
+        start of the first step in which the club held particles to the end
+        of the last), steps, t, aborted, and with config.monitor the largest
+        relative energy_drift and momentum_drift
+    """
+    state = reset_headless(config)
+    particles = state['particles']
+    club = state['club']
+
+    t = 0
+    dt = TIMESTEP
+    steps = 0
+    reported = 0
+
+    centers = []
+    changes = array([])
+    omegas = array([])
+    last_vec = vector(0, 0, 0)
+    hybrid = {'body': None, 'free_steps': 0}
+    contacts = 0
+    contact = [None, None]
+    released = False
+    aborted = False
+
+    exporter = None
+    if config.export is not None:
+        exporter = VTKExporter(config.export, particles, config.export_stride)
+
+    recorder = None
+    if config.record is not None:
+        recorder = RunRecorder(config.record, particles, club, config.record_stride, config)
+
+    monitor = None
+    monitor_stream = None
+    if config.monitor > 0:
+        if config.monitor_file is not None:
+            monitor_stream = open(config.monitor_file, "w")
+        monitor = ConservationMonitor(particles, config.monitor, monitor_stream,
+                                      config.energy_alarm, config.momentum_alarm)
+
+    while t < duration:
+        step = animate_hybrid(club, particles, None, hybrid, None, t, dt, config)
+
+        plot_info = plot(particles, centers, changes, omegas, last_vec, t, step, None)
+        last_vec = plot_info['current_vec']
+        changes = plot_info['changes']
+        omegas = plot_info['omegas']
+        t += step
+        steps += 1
+
+        if club.contacts > contacts:
+            contacts = club.contacts
+            contact = [t - step if contact[0] is None else contact[0], t]
+
+        if monitor is not None:
+            monitor.sample(particles, club, t)
+        if exporter is not None:
+            exporter.write(particles, t)
+        if recorder is not None:
+            recorder.write(particles, t, step)
+        if observe is not None:
+            observe(t, particles)
+
+        if progress is not None and int(100 * t / duration) > reported:
+            reported = int(100 * t / duration)
+            progress(min(t / duration, 1.0))
+
+        if stop is not None:
+            released = released or separated(particles, club, step)
+            if released and stop(t, plot_info):
+                aborted = True
+                break
+
+    if exporter is not None:
+        exporter.close()
+    if recorder is not None:
+        recorder.close()
+    if monitor_stream is not None:
+        monitor_stream.close()
+
+    metrics = get_metrics(changes, omegas, plot_info['vcom'], hybrid['body'])
+    metrics['spin'] = float((hybrid['body'] or make_rigid(particles, False)).omega.z)
+    metrics['contact'] = None if contact[0] is None else contact[1] - contact[0]
+    if monitor is not None:
+        metrics['energy_drift'] = monitor.peaks['energy']
+        metrics['momentum_drift'] = monitor.peaks['momentum']
+    metrics['steps'] = steps
+    metrics['t'] = t
+    metrics['aborted'] = aborted
+
+    return metrics
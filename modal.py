@@ -0,0 +1,329 @@
+##################################################################
+## MODAL - reduced-order model of the ball in its vibration modes
+##################################################################
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from numpy import (array, arange, bincount, diag, hstack, sqrt, zeros, outer, identity, repeat,
+                   load, savez, cross as cross3)
+from numpy.linalg import det, eigh, qr, solve, svd
+
+from cache import ResultCache, config_key
+from constants import (
+    TIMESTEP, IMPACT_DURATION, CONTACT_TOLERANCE, DAMPING, CACHE_DIR,
+    MODAL_MODES,
+)
+from diagnostics import spring_edges, get_state
+from headless import headless_config, reset_headless, run_impact
+
+RIGID_MODES = 6
+CONTACT_DEPTH = 0.5  # fraction of the ball radius from its front whose particles get contact corrections
+SPIN_FLOOR = 1.0  # rad/s; below this a shot has no spin to take a relative error of
+
+
+def stiffness_matrix(positions, edges):
+    """Assemble the stiffness matrix of the spring network linearized about positions."""
+    count = len(positions)
+    stiffness = zeros((3 * count, 3 * count))
+
+    for i, j, constant in zip(edges['first'], edges['second'], DAMPING * edges['constant']):
+        axis = positions[i] - positions[j]
+        axis /= sqrt((axis ** 2).sum())
+        block = constant * outer(axis, axis)
+
+        stiffness[3 * i:3 * i + 3, 3 * i:3 * i + 3] += block
+        stiffness[3 * j:3 * j + 3, 3 * j:3 * j + 3] += block
+        stiffness[3 * i:3 * i + 3, 3 * j:3 * j + 3] -= block
+        stiffness[3 * j:3 * j + 3, 3 * i:3 * i + 3] -= block
+
+    return stiffness
+
+
+def model_key(positions, masses, edges):
+    """Hash the rest geometry, masses and springs of a model."""
+    digest = hashlib.sha1()
+    for values in (positions, masses, edges['first'], edges['second'], edges['rest'], edges['constant']):
+        digest.update(values.tobytes())
+    digest.update(str(DAMPING).encode())
+
+    return digest.hexdigest()
+
+
+def compute_modes(positions, masses, edges):
+    """
+    Compute the vibration modes of the spring network.
+
+    Solves K phi = w^2 M phi through the mass-scaled symmetric problem. The
+    first RIGID_MODES modes are the zero-frequency rigid-body motions.
+
+    Returns:
+        Dict with frequencies (rad/s) and mass-normalized shapes [3N, 3N]
+    """
+    scale = 1 / sqrt(repeat(masses, 3))
+    stiffness = stiffness_matrix(positions, edges)
+    values, vectors = eigh(stiffness * outer(scale, scale))
+
+    frequencies = sqrt(values.clip(min=0))
+    frequencies[:RIGID_MODES] = 0
+
+    return {
+        'frequencies': frequencies,
+        'shapes': scale[:, None] * vectors,
+    }
+
+
+def get_modes(positions, masses, edges, directory=CACHE_DIR):
+    """Get the modes of a model, computing them once and caching them on disk."""
+    path = os.path.join(directory, "modes_" + model_key(positions, masses, edges) + ".npz")
+    if os.path.exists(path):
+        cached = load(path)
+        return {'frequencies': cached['frequencies'], 'shapes': cached['shapes']}
+
+    modes = compute_modes(positions, masses, edges)
+    os.makedirs(directory, exist_ok=True)
+    savez(path, **modes)
+
+    return modes
+
+
+def make_basis(modes, positions, masses, direction, count):
+    """
+    Get the deformations the ball is simulated in.
+
+    These are the lowest count vibration modes, extended to the end of a
+    degenerate set so that truncating does not break the ball's symmetry,
+    followed by the static deformation under a load on each particle within
+    CONTACT_DEPTH of the front of the ball along direction. The club moves
+    those particles by far more than the low modes can follow, so the static
+    corrections carry the local flattening. Everything is mass-orthonormal
+    to everything else and to the rigid-body motions.
+
+    Returns:
+        Shapes [3N, vibration modes + corrections], and the number of vibration modes
+    """
+    frequencies = modes['frequencies'][RIGID_MODES:]
+    shapes = modes['shapes'][:, RIGID_MODES:]
+    count = min(max(count, 0), len(frequencies))
+    while 0 < count < len(frequencies) and frequencies[count] - frequencies[count - 1] < 1e-6 * frequencies[count]:
+        count += 1
+    vibration = shapes[:, :count]
+
+    # the static response to a load, within the vibration modes that resist it
+    elastic = frequencies > 1e-6 * frequencies.max()
+    flexibility = (shapes[:, elastic] / frequencies[elastic] ** 2) @ shapes[:, elastic].T
+
+    offsets = positions - (masses[:, None] * positions).sum(axis=0) / masses.sum()
+    depths = offsets @ direction
+    reached = (depths > depths.max() * (1 - CONTACT_DEPTH)).nonzero()[0]
+    corrections = flexibility[:, (3 * reached[:, None] + arange(3)).ravel()]
+
+    # keep what the vibration modes do not already hold, and drop the rest as rounding
+    weights = repeat(masses, 3)
+    size = sqrt((weights[:, None] * corrections ** 2).sum(axis=0)).max()
+    corrections -= vibration @ (vibration.T @ (weights[:, None] * corrections))
+    orthonormal, triangle = qr(sqrt(weights)[:, None] * corrections)
+    independent = abs(diag(triangle)) > 1e-6 * size
+    corrections = orthonormal[:, independent] / sqrt(weights)[:, None]
+
+    return hstack((vibration, corrections)), count
+
+
+def spring_forces(positions, edges, constants):
+    """Net spring force on every particle, as spring_force computes it, with DAMPING folded into constants."""
+    stretch = positions[edges['first']] - positions[edges['second']]
+    lengths = sqrt((stretch ** 2).sum(axis=1))
+    pulls = (-constants * (lengths - edges['rest']) / lengths)[:, None] * stretch
+
+    count = len(positions)
+    return array([bincount(edges['first'], pulls[:, axis], count) - bincount(edges['second'], pulls[:, axis], count)
+                  for axis in range(3)]).T
+
+
+def axial(moments):
+    """Sum of the cross products a x b whose outer products a b^T sum to moments."""
+    return array([moments[1, 2] - moments[2, 1], moments[2, 0] - moments[0, 2], moments[0, 1] - moments[1, 0]])
+
+
+def get_launch(positions, velocities, masses):
+    """Get the center of mass velocity and angular velocity of a particle state."""
+    total = masses.sum()
+    rcom = (masses[:, None] * positions).sum(axis=0) / total
+    vcom = (masses[:, None] * velocities).sum(axis=0) / total
+
+    offsets = positions - rcom
+    spin = (masses[:, None] * cross3(offsets, velocities - vcom)).sum(axis=0)
+    inertia = zeros((3, 3))
+    for mass, offset in zip(masses, offsets):
+        inertia += mass * ((offset ** 2).sum() * identity(3) - outer(offset, offset))
+
+    return vcom, solve(inertia, spin)
+
+
+def run_modal(config, count=MODAL_MODES, duration=IMPACT_DURATION, dt=TIMESTEP):
+    """
+    Simulate one impact in a floating frame with a truncated modal basis.
+
+    The ball's rigid-body motion is kept in full, as its center of mass and
+    the rotation that best fits the particles to their rest shape, while its
+    deformation in that rotating frame is kept in the basis of make_basis.
+    Each step is the particle model's step, springs and club contact
+    included, after which the particles are projected back onto the basis:
+    positions through the fitted rotation, and velocities through the spin
+    that leaves the deformation rate free of rest-shape rotation. With every
+    mode kept the projection changes nothing and the particle model is
+    reproduced; fewer modes filter out the fastest vibration.
+
+    Returns:
+        Dict with contact (time from the first step in which the club held
+        particles to the end of the last, as run_impact measures it), vcom,
+        speed, omega, modes, corrections, steps, t
+    """
+    state = reset_headless(config)
+    particles = state['particles']
+    club = state['club']
+
+    rest, _ = get_state(particles)
+    masses = array([particle.mass for particle in particles])
+    edges = spring_edges(particles)
+    constants = DAMPING * edges['constant']
+
+    normal = array([club.norm.x, club.norm.y, club.norm.z])
+    normal /= sqrt((normal ** 2).sum())
+    club_pos = array([club.pos.x, club.pos.y, club.pos.z])
+    club_velocity = array([club.velocity.x, club.velocity.y, club.velocity.z])
+    threshold = array([particle.radius for particle in particles]) * CONTACT_TOLERANCE
+
+    shapes, modes = make_basis(get_modes(rest, masses, edges), rest, masses, -normal, count)
+    projection = (shapes * repeat(masses, 3)[:, None]).T
+    total = masses.sum()
+    shape = rest - (masses[:, None] * rest).sum(axis=0) / total
+    moments = masses[:, None] * shape
+
+    positions = rest.copy()
+    velocities = zeros(rest.shape)
+    t = 0
+    steps = 0
+    contact = [None, None]
+
+    while t < duration:
+        # the particle model's step, as in determine_update_method and animate_particles
+        forces = spring_forces(positions, edges, constants)
+        moved = velocities + forces / masses[:, None] * dt
+        club_pos = club_pos + club_velocity * dt
+        touching = (positions + moved * dt - club_pos) @ normal < -threshold
+
+        moved_positions = positions + moved * dt
+        if touching.any():
+            contact = [t if contact[0] is None else contact[0], t + dt]
+            gaps = (positions[touching] - club_pos) @ normal
+            moved_positions[touching] = positions[touching] - gaps[:, None] * normal
+            moved[touching] = club_velocity
+
+        # the rotation that best fits the rest shape to the particles
+        center = (masses[:, None] * moved_positions).sum(axis=0) / total
+        left, _, right = svd(moments.T @ (moved_positions - center))
+        rotation = right.T @ diag([1, 1, det(right.T @ left.T)]) @ left.T
+
+        q = projection @ ((moved_positions - center) @ rotation - shape).ravel()
+        body = shape + (shapes @ q).reshape(-1, 3)
+        positions = center + body @ rotation.T
+
+        # the spin for which the rest of the body-frame velocity is deformation
+        vcom = (masses[:, None] * moved).sum(axis=0) / total
+        relative = (moved - vcom) @ rotation
+        inertia = (moments * body).sum() * identity(3) - body.T @ moments
+        spin = solve(inertia, axial(moments.T @ relative))
+        swirl = body @ array([[0, spin[2], -spin[1]], [-spin[2], 0, spin[0]], [spin[1], -spin[0], 0]])
+        qdot = projection @ (relative - swirl).ravel()
+        velocities = vcom + (swirl + (shapes @ qdot).reshape(-1, 3)) @ rotation.T
+
+        t += dt
+        steps += 1
+
+    vcom, omega = get_launch(positions, velocities, masses)
+
+    return {
+        'contact': None if contact[0] is None else contact[1] - contact[0],
+        'vcom': [float(value) for value in vcom],
+        'speed': float(sqrt((vcom ** 2).sum())),
+        'omega': float(omega[2]),
+        'modes': modes,
+        'corrections': shapes.shape[1] - modes,
+        'steps': steps,
+        't': t,
+    }
+
+
+def compare(config, count, cache):
+    """Run the modal and full models of one impact and report the modal error."""
+    start = time.perf_counter()
+    modal = run_modal(config, count)
+    modal_time = time.perf_counter() - start
+
+    key = config_key(config)
+    full = cache.get(key)
+    full_time = None
+    if full is None or 'spin' not in full:
+        start = time.perf_counter()
+        full = run_impact(config)
+        full_time = time.perf_counter() - start
+        cache.put(key, config, full)
+
+    speed_error = abs(modal['speed'] - full['speed']) / full['speed']
+    omega_error = None
+    if abs(full['spin']) > SPIN_FLOOR:
+        omega_error = abs(modal['omega'] - full['spin']) / abs(full['spin'])
+
+    return {
+        'modal': modal,
+        'full': full,
+        'speed_error': speed_error,
+        'omega_error': omega_error,
+        'modal_time': modal_time,
+        'full_time': full_time,
+    }
+
+
+def parse_modal_args():
+    """Parse command-line arguments for a modal run."""
+    parser = argparse.ArgumentParser(
+        description="Simulate an impact with a reduced-order modal model of the ball",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-v", "--club-velocity", type=float, default=64.82, help="Club impact speed in m/s")
+    parser.add_argument("-l", "--loft", type=float, default=0, help="Club loft angle in degrees")
+    parser.add_argument("--modes", type=int, default=MODAL_MODES,
+                        help="Vibration modes kept besides the rigid-body motion and the contact corrections")
+    parser.add_argument("--compare", action="store_true", default=False,
+                        help="Also run (or load from the cache) the full model and report the modal error")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Directory of cached results")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_modal_args()
+    config = headless_config(club_velocity=args.club_velocity, loft=args.loft)
+    if args.modes < MODAL_MODES:
+        print("warning: with fewer than " + str(MODAL_MODES) + " modes the golden shots are up to 1% off in"
+              " launch speed, 7% in spin and 7% in contact time", file=sys.stderr)
+
+    if not args.compare:
+        result = run_modal(config, args.modes)
+        print("velocity is " + str(result['vcom']) + " omega is " + str(result['omega']))
+        return
+
+    report = compare(config, args.modes, ResultCache(args.cache_dir))
+    print("modal: speed " + str(report['modal']['speed']) + " omega " + str(report['modal']['omega'])
+          + " in " + str(report['modal_time']) + " s")
+    print("full:  speed " + str(report['full']['speed']) + " omega " + str(report['full']['spin'])
+          + ("" if report['full_time'] is None else " in " + str(report['full_time']) + " s"))
+    print("speed error " + str(report['speed_error']) + ", omega error " + str(report['omega_error']))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,34 @@
 ## CLASSES
 ##################################################################
 
+from enum import IntEnum
+
+from vpython import vector
+
+
+class Relation(IntEnum):
+    """Which layers a spring connects."""
+    NEIGHBOR = 0  # particles of the same shell
+    NESTED = 1  # particles of adjacent shells
+
+
+class UpdateMethod(IntEnum):
+    """How a particle is moved in the current step."""
+    NONE = 0
+    MOMENTUM = 1  # integrate the spring force
+    CLUB = 2  # pinned to the club face
+    MIRROR = 3  # mirror image of another particle
+
 
 class Spring:
     """Represents a spring connection between particles."""
-    neighbor = -1
-    relation = ""
-    rest = 0
-    constant = 0
-    modulus = 0
+    __slots__ = ("neighbor", "relation", "rest", "constant", "modulus")
 
     def __init__(self, ind, rel, r, y, young=True):
         self.neighbor = ind
         self.relation = rel
         self.rest = r
+        self.modulus = 0
         if young:
             self.modulus = y
             self.constant = (y * (r ** 2)) / r
@@ -22,16 +37,32 @@ class Spring:
             self.constant = y
 
 
+class Marker:
+    """Stand-in for a VPython primitive when running without a canvas."""
+
+    def __init__(self, **attributes):
+        self.pos = None
+        self.radius = 0
+        self.color = None
+        self.__dict__.update(attributes)
+
+
 class Particle:
     """Wrapper for a VPython sphere with physics properties."""
+    __slots__ = ("visual", "velocity", "mass", "springs", "update_method", "stored_force",
+                 "soft_force", "stiff_force", "image", "mirrored", "momentum")
 
     def __init__(self, visual, velocity, mass):
         self.visual = visual  # The VPython sphere
         self.velocity = velocity
         self.mass = mass
         self.springs = []
-        self.update_method = ""
-        self.stored_force = None
+        self.update_method = UpdateMethod.NONE
+        self.stored_force = vector(0, 0, 0)  # spring force buffer, rewritten every step
+        self.soft_force = None  # nested spring force carried between multi-rate steps
+        self.stiff_force = None  # neighbor spring force carried between multi-rate steps
+        self.image = None  # index of the particle this one mirrors across z = 0
+        self.mirrored = False  # whether another particle mirrors this one
         self.momentum = mass * velocity
 
     @property
@@ -59,6 +90,19 @@ class Particle:
         self.visual.color = value
 
 
+class RigidBody:
+    """Rigid-body state of the ball while it flies free of the club."""
+
+    def __init__(self, com, velocity, omega, mass, offsets, deviations, vibration_energy):
+        self.com = com  # center of mass position
+        self.velocity = velocity  # center of mass velocity
+        self.omega = omega  # angular velocity
+        self.mass = mass
+        self.offsets = offsets  # particle positions relative to the center of mass
+        self.deviations = deviations  # particle velocities not explained by rigid motion
+        self.vibration_energy = vibration_energy
+
+
 class Club:
     """Wrapper for a VPython box with physics properties."""
 
@@ -67,6 +111,10 @@ class Club:
         self.velocity = velocity
         self.norm = None
         self.point = None
+        self.contacts = 0  # particle updates pinned to the club face so far
+        self.impulse = vector(0, 0, 0)  # momentum the club has given the ball so far
+        self.angular_impulse = vector(0, 0, 0)  # and angular momentum about the origin
+        self.work = 0  # and energy
 
     @property
     def pos(self):
@@ -0,0 +1,234 @@
+##################################################################
+## OPTIMIZER - search club parameters for a target launch
+##################################################################
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from vpython import mag
+from numpy import array, clip
+
+from cache import ResultCache, config_key
+from constants import CACHE_DIR, MAX_SUBSTEPS
+from headless import headless_config, run_impact
+
+# searched Config fields with their bounds
+PARAMETERS = ('club_velocity', 'loft')
+LOWER = array([1.0, 0.0])
+UPPER = array([100.0, 60.0])
+
+# spin errors are measured relative to at least this many rad/s
+SPIN_SCALE = 100.0
+
+# Nelder-Mead coefficients: reflection, expansion, contraction, shrink
+ALPHA = 1.0
+GAMMA = 2.0
+RHO = 0.5
+SIGMA = 0.5
+
+
+def speed_error(speed, target_speed):
+    """Squared relative error of the launch speed."""
+    return ((speed - target_speed) / target_speed) ** 2
+
+
+def objective(result, target_speed, target_spin):
+    """
+    Score a run against the targets; lower is better.
+
+    The spin is the rigid fit of the final state, which is the same quantity
+    whether or not the ball collapsed into a rigid body. An aborted run was
+    cut short before its spin settled, so only its speed error counts, which
+    is a lower bound on the score it would have reached.
+    """
+    score = speed_error(result['speed'], target_speed)
+    if not result['aborted']:
+        score += ((result['spin'] - target_spin) / max(abs(target_spin), SPIN_SCALE)) ** 2
+
+    return score
+
+
+def evaluate(settings, target_speed, target_spin, threshold):
+    """Run one candidate in a worker process, abandoning it once it cannot beat threshold."""
+    def stop(t, plot_info):
+        return threshold is not None and speed_error(mag(plot_info['vcom']), target_speed) > threshold
+
+    return run_impact(headless_config(**settings), stop=stop)
+
+
+class BatchEvaluator:
+    """Score batches of candidate points in parallel, reusing cached runs."""
+
+    def __init__(self, target_speed, target_spin, fixed, workers, cache):
+        self.target_speed = target_speed
+        self.target_spin = target_spin
+        self.fixed = fixed  # Config overrides that are not searched
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.cache = cache
+        self.runs = 0
+        self.cached = 0
+
+    def settings(self, point):
+        return dict(self.fixed, **{name: float(value) for name, value in zip(PARAMETERS, point)})
+
+    def score(self, points, threshold=None):
+        """Score each point, aborting runs that cannot score below threshold."""
+        scores = [None] * len(points)
+        pending = []
+
+        for index, point in enumerate(points):
+            config = headless_config(**self.settings(point))
+            result = self.cache.get(config_key(config))
+            # results cached before the rigid-fit spin was reported are rerun
+            if result is not None and 'spin' in result:
+                scores[index] = objective(result, self.target_speed, self.target_spin)
+                self.cached += 1
+            else:
+                future = self.pool.submit(evaluate, self.settings(point),
+                                          self.target_speed, self.target_spin, threshold)
+                pending.append((index, config, future))
+
+        for index, config, future in pending:
+            result = future.result()
+            if not result['aborted']:
+                self.cache.put(config_key(config), config, result)
+            scores[index] = objective(result, self.target_speed, self.target_spin)
+            self.runs += 1
+
+        return scores
+
+    def warm_start(self):
+        """Get the best cached point that matches the fixed settings, or None."""
+        best = None
+        for key, settings, result in self.cache.entries():
+            if not all(name in settings for name in PARAMETERS) or 'spin' not in result:
+                continue
+
+            point = array([settings[name] for name in PARAMETERS])
+            if key != config_key(headless_config(**self.settings(point))):
+                continue
+
+            score = objective(result, self.target_speed, self.target_spin)
+            if best is None or score < best[1]:
+                best = (point, score)
+
+        return best
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def nelder_mead(evaluator, start, step, max_runs, tolerance, debug=False):
+    """
+    Minimize the objective with a batch-parallel Nelder-Mead simplex.
+
+    Every iteration scores the reflected, expanded and both contracted points
+    together as one batch, then applies the usual Nelder-Mead rules to them.
+    Candidates that clearly score worse than the worst vertex are aborted as
+    soon as their launch speed is known.
+
+    Returns:
+        Dict with point, score, runs, cached
+    """
+    simplex = [clip(start, LOWER, UPPER)]
+    for axis in range(len(start)):
+        vertex = array(start, dtype=float)
+        vertex[axis] += step[axis]
+        simplex.append(clip(vertex, LOWER, UPPER))
+    scores = evaluator.score(simplex)
+
+    for iteration in range(max_runs):
+        if evaluator.runs >= max_runs:
+            break
+
+        order = sorted(range(len(simplex)), key=lambda index: scores[index])
+        simplex = [simplex[index] for index in order]
+        scores = [scores[index] for index in order]
+
+        if debug:
+            print("best " + str(dict(zip(PARAMETERS, simplex[0]))) + " scores " + str(scores[0]))
+
+        if scores[0] < tolerance or abs(scores[-1] - scores[0]) < tolerance ** 2:
+            break
+
+        worst = simplex[-1]
+        centroid = sum(simplex[:-1]) / (len(simplex) - 1)
+        reflected = clip(centroid + ALPHA * (centroid - worst), LOWER, UPPER)
+        expanded = clip(centroid + GAMMA * (reflected - centroid), LOWER, UPPER)
+        outside = clip(centroid + RHO * (reflected - centroid), LOWER, UPPER)
+        inside = clip(centroid - RHO * (centroid - worst), LOWER, UPPER)
+        f_r, f_e, f_oc, f_ic = evaluator.score([reflected, expanded, outside, inside], scores[-1])
+
+        if f_r < scores[0]:
+            simplex[-1], scores[-1] = (expanded, f_e) if f_e < f_r else (reflected, f_r)
+        elif f_r < scores[-2]:
+            simplex[-1], scores[-1] = reflected, f_r
+        elif f_r < scores[-1] and f_oc <= f_r:
+            simplex[-1], scores[-1] = outside, f_oc
+        elif f_r >= scores[-1] and f_ic < scores[-1]:
+            simplex[-1], scores[-1] = inside, f_ic
+        else:
+            simplex = [simplex[0]] + [simplex[0] + SIGMA * (vertex - simplex[0]) for vertex in simplex[1:]]
+            scores = [scores[0]] + evaluator.score(simplex[1:])
+
+    best = min(range(len(simplex)), key=lambda index: scores[index])
+    return {
+        'point': dict(zip(PARAMETERS, (float(value) for value in simplex[best]))),
+        'score': scores[best],
+        'runs': evaluator.runs,
+        'cached': evaluator.cached,
+    }
+
+
+def parse_optimizer_args():
+    """Parse command-line arguments for the optimizer."""
+    parser = argparse.ArgumentParser(
+        description="Search club velocity and loft for a target launch speed and spin",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--speed", type=float, required=True, help="Target launch speed in m/s")
+    parser.add_argument("--spin", type=float, required=True, help="Target spin in rad/s")
+    parser.add_argument("-v", "--club-velocity", type=float, default=64.82,
+                        help="Starting club speed in m/s (a better cached run takes precedence)")
+    parser.add_argument("-l", "--loft", type=float, default=10, help="Starting loft in degrees")
+    parser.add_argument("--step", type=float, nargs=2, default=[5.0, 5.0], metavar=("VELOCITY", "LOFT"),
+                        help="Initial simplex size along each parameter")
+    parser.add_argument("--rigid", action="store_true", default=False,
+                        help="Collapse the ball into a rigid body once it leaves the club face")
+    parser.add_argument("--substeps", type=int, default=1,
+                        help="Fine steps of the stiff springs per coarse step (at most %d)" % MAX_SUBSTEPS)
+    parser.add_argument("--workers", type=int, default=4, help="Simulations run in parallel")
+    parser.add_argument("--max-runs", type=int, default=60, help="Simulations to run before giving up")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Score that counts as on target")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Directory of cached results")
+    parser.add_argument("--debug", action="store_true", default=False, help="Print every iteration")
+
+    args = parser.parse_args()
+    if not 1 <= args.substeps <= MAX_SUBSTEPS:
+        parser.error("--substeps must be between 1 and " + str(MAX_SUBSTEPS))
+
+    return args
+
+
+def main():
+    args = parse_optimizer_args()
+    fixed = {'rigid': args.rigid, 'substeps': args.substeps}
+    evaluator = BatchEvaluator(args.speed, args.spin, fixed, args.workers, ResultCache(args.cache_dir))
+
+    start = array([args.club_velocity, args.loft])
+    cached = evaluator.warm_start()
+    if cached is not None:
+        start = cached[0]
+        print("warm start from cached run " + str(dict(zip(PARAMETERS, start))))
+
+    try:
+        best = nelder_mead(evaluator, start, array(args.step), args.max_runs, args.tolerance, args.debug)
+    finally:
+        evaluator.shutdown()
+
+    print("best " + str(best['point']) + " scores " + str(best['score']))
+    print(str(best['runs']) + " simulations run, " + str(best['cached']) + " answered from the cache")
+
+
+if __name__ == '__main__':
+    main()
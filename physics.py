@@ -2,17 +2,23 @@
 ## PHYSICS / ANIMATION
 ##################################################################
 
-from vpython import vector, mag, mag2, norm, dot, cos, sin, tan, atan, radians
+from vpython import vector, mag, mag2, norm, dot, cross, cos, sin, tan, atan, radians, sqrt
+from numpy import array, identity, outer, zeros
+from numpy.linalg import solve
 
-from constants import VERTS, NEIGHBOR_TOLERANCE, CONTACT_TOLERANCE, DAMPING
-from models import Spring
+from constants import (
+    VERTS, NEIGHBOR_TOLERANCE, CONTACT_TOLERANCE, DAMPING,
+    RIGID_TIMESTEP, SEPARATION_STEPS,
+)
+from models import Spring, RigidBody, Relation, UpdateMethod
 
 
-def connect_layers(particles, layers, modulus, config):
-    """Connect particles between adjacent layers with springs."""
-    threshold = mag(particles[layers[-3]].pos - particles[layers[-2]].pos) * NEIGHBOR_TOLERANCE
-    if layers[-1] - layers[-2] >= VERTS:
-        threshold = mag(particles[layers[-3] + VERTS].pos - particles[layers[-2]].pos) * NEIGHBOR_TOLERANCE
+def connect_layers(particles, layers, modulus, config, threshold=None):
+    """Connect particles between adjacent layers with springs (within threshold if given)."""
+    if threshold is None:
+        threshold = mag(particles[layers[-3]].pos - particles[layers[-2]].pos) * NEIGHBOR_TOLERANCE
+        if layers[-1] - layers[-2] >= VERTS:
+            threshold = mag(particles[layers[-3] + VERTS].pos - particles[layers[-2]].pos) * NEIGHBOR_TOLERANCE
 
     if config.debug:
         print("connecting " + str(layers[-1] - layers[-2]) + " to outer layer within " + str(threshold))
@@ -26,8 +32,8 @@ def connect_layers(particles, layers, modulus, config):
                 raise AssertionError("two points in the same layer are trying to be connected")
 
             elif distance < threshold:
-                particles[outer].springs.append(Spring(inner, "nested", distance, modulus, True))
-                particles[inner].springs.append(Spring(outer, "nested", distance, modulus, True))
+                particles[outer].springs.append(Spring(inner, Relation.NESTED, distance, modulus, True))
+                particles[inner].springs.append(Spring(outer, Relation.NESTED, distance, modulus, True))
 
 
 def connect_neighbors(particles, start, modulus, config):
@@ -48,7 +54,101 @@ def connect_neighbors(particles, start, modulus, config):
                 continue
 
             elif distance < threshold:
-                particles[outer].springs.append(Spring(inner, "neighbor", distance, modulus, True))
+                particles[outer].springs.append(Spring(inner, Relation.NEIGHBOR, distance, modulus, True))
+
+
+def connect_patch_neighbors(particles, start, patch, modulus, config):
+    """Connect the neighbors of a locally refined shell along its triangulation."""
+    if config.debug:
+        print("connecting " + str(len(patch['edges'])) + " patch neighbors")
+
+    for first, second in patch['edges']:
+        distance = mag(particles[start + first].pos - particles[start + second].pos)
+        particles[start + first].springs.append(Spring(start + second, Relation.NEIGHBOR, distance, modulus, True))
+        particles[start + second].springs.append(Spring(start + first, Relation.NEIGHBOR, distance, modulus, True))
+
+
+def scale_patch(particles, start, patch, config):
+    """
+    Keep the mass and stiffness of a refined patch consistent with the coarse shell.
+
+    A triangulated shell is as stiff as its individual springs whatever their
+    spacing, while a spring's constant grows with its rest length. Every
+    spring with a fine end is therefore scaled by the coarse spacing over its
+    rest length, which gives it the constant of a coarse spring, but by no
+    less than 1 and no more than config.refine, the scaling of a spring as
+    long as a coarse one and of one as short as a fine one. Each particle's
+    mass and nested springs follow the weight of the shell area it stands for.
+    """
+    stop = start + len(patch['fine'])
+
+    def is_fine(index):
+        return start <= index < stop and patch['fine'][index - start]
+
+    for index, particle in enumerate(particles):
+        if start <= index < stop:
+            particle.mass = config.particle_mass * patch['weights'][index - start]
+            particle.momentum = particle.mass * particle.velocity
+
+        for spring in particle.springs:
+            if spring.relation == Relation.NEIGHBOR:
+                if is_fine(index) or is_fine(spring.neighbor):
+                    spring.constant *= min(config.refine, max(1, patch['coarse_spacing'] / spring.rest))
+            elif start <= index < stop:
+                spring.constant *= patch['weights'][index - start]
+            elif start <= spring.neighbor < stop:
+                spring.constant *= patch['weights'][spring.neighbor - start]
+
+
+def make_symmetric(particles, club, config):
+    """
+    Simulate only the z >= 0 half of the ball when the impact is symmetric about z = 0.
+
+    Every particle below the plane becomes the mirror image of its counterpart
+    above it, so only the upper half is integrated while springs that cross
+    the plane still see the full ball.
+
+    Returns:
+        True if the impact is symmetric and the particles were paired up
+    """
+    tolerance = config.ball_radius * 1e-9
+    if abs(club.velocity.z) > tolerance or abs(club.pos.z) > tolerance or abs(club.norm.z) > tolerance:
+        return False
+
+    images = []
+    for particle in particles:
+        mirrored = vector(particle.pos.x, particle.pos.y, -particle.pos.z)
+        image = None
+        for index, other in enumerate(particles):
+            if mag(other.pos - mirrored) < tolerance and other.mass == particle.mass:
+                image = index
+                break
+        if image is None:
+            return False
+        images.append(image)
+
+    # snap the pairs to exact mirror images, so the half model starts at rest
+    # instead of from rounding offsets that grow into noise before impact
+    for particle, image in zip(particles, images):
+        if particle.pos.z < -tolerance:
+            particle.image = image
+            particles[image].mirrored = True
+            particle.pos = vector(particles[image].pos.x, particles[image].pos.y, -particles[image].pos.z)
+        elif particle.pos.z <= tolerance:
+            particle.pos = vector(particle.pos.x, particle.pos.y, 0)
+
+    for particle in particles:
+        for spring in particle.springs:
+            rest = mag(particle.pos - particles[spring.neighbor].pos)
+            if spring.modulus:
+                spring.constant *= rest / spring.rest
+            spring.rest = rest
+
+    if config.debug:
+        print("simulating " + str(sum(particle.image is None for particle in particles))
+              + " of " + str(len(particles)) + " particles by mirror symmetry")
+
+    return True
 
 
 def get_club_plane(club, config):
@@ -85,26 +185,128 @@ def find_nearest_point(point, club):
     return vector(xp, yp, zp)
 
 
-def update_club(particle, club):
-    """Update particle position/properties based on club position."""
+def update_club(particle, club, force, dt):
+    """
+    Update particle position/properties based on club position.
+
+    The club is credited with the impulse and kinetic energy that take the
+    particle from where force would have moved it over dt to its place on the
+    face; credit_snaps adds the spring energy once every particle has moved.
+
+    Returns:
+        Where force would have moved the particle
+    """
+    momentum = particle.momentum + force * dt
+    pos = particle.pos + momentum / particle.mass * dt
+
     particle.pos = find_nearest_point(particle.pos, club)
     particle.velocity = club.velocity
     particle.momentum = particle.mass * particle.velocity
 
+    impulse = particle.momentum - momentum
+    credit_club(club, particle, impulse, cross(particle.pos, particle.momentum) - cross(pos, momentum),
+                dot(impulse, particle.momentum + momentum) / (2 * particle.mass))
+    club.contacts += 1
+
+    return pos
+
+
+def credit_club(club, particle, impulse, angular_impulse, work):
+    """Add what the club gave a particle, and its mirror image if it has one, to the club's totals."""
+    club.impulse += impulse
+    club.angular_impulse += angular_impulse
+    club.work += work
+
+    if particle.mirrored:
+        club.impulse += vector(impulse.x, impulse.y, -impulse.z)
+        club.angular_impulse += vector(-angular_impulse.x, -angular_impulse.y, angular_impulse.z)
+        club.work += work
+
+
+def credit_snaps(particles, club, snapped):
+    """
+    Credit the club with the spring energy it changed by pinning particles in a step.
+
+    snapped maps each particle update_club moved to where force would have
+    moved it. The mirror images of those particles moved with them, and a
+    spring between two moved particles is counted once.
+    """
+    if not snapped:
+        return
+
+    for particle in particles:
+        if particle.image is not None and particles[particle.image] in snapped:
+            pos = snapped[particles[particle.image]]
+            snapped[particle] = vector(pos.x, pos.y, -pos.z)
+
+    work = 0
+    done = set()
+    for particle, pos in snapped.items():
+        done.add(particle)
+        for spring in particle.springs:
+            neighbor = particles[spring.neighbor]
+            if neighbor in done:
+                continue
+            other = snapped.get(neighbor, neighbor.pos)
+            work += spring.constant * ((mag(particle.pos - neighbor.pos) - spring.rest) ** 2
+                                       - (mag(pos - other) - spring.rest) ** 2)
+
+    club.work += DAMPING * work / 2
+
+
+def spring_force(particle, particles, relation=None, out=None):
+    """
+    Damped net spring force on a particle, optionally from springs of one relation only.
+
+    The force is summed in floats and written into out when given, so the
+    per-step force evaluations do not allocate any vectors.
+    """
+    pos = particle.pos
+    x, y, z = pos.x, pos.y, pos.z
+    fx = fy = fz = 0
+    for spring in particle.springs:
+        if relation is None or spring.relation == relation:
+            other = particles[spring.neighbor].pos
+            dx, dy, dz = x - other.x, y - other.y, z - other.z
+            length = sqrt(dx * dx + dy * dy + dz * dz)
+            if length == 0:
+                continue
+            scale = -spring.constant * (length - spring.rest) / length
+            fx += scale * dx
+            fy += scale * dy
+            fz += scale * dz
+
+    if out is None:
+        return vector(fx * DAMPING, fy * DAMPING, fz * DAMPING)
+
+    out.x = fx * DAMPING
+    out.y = fy * DAMPING
+    out.z = fz * DAMPING
+    return out
+
+
+def update_mirror(particle, image):
+    """Place a particle at the mirror image of its counterpart across z = 0."""
+    particle.pos = vector(image.pos.x, image.pos.y, -image.pos.z)
+    particle.velocity = vector(image.velocity.x, image.velocity.y, -image.velocity.z)
+    particle.momentum = particle.mass * particle.velocity
+
+
+def update_mirrors(particles):
+    """Update every mirrored particle from its counterpart."""
+    for particle in particles:
+        if particle.image is not None:
+            update_mirror(particle, particles[particle.image])
+
 
 def determine_update_method(particles, club, dt, config):
     """Determine which method to use for updating each particle."""
     for particle in particles:
-        forces = []
-        for spring in particle.springs:
-            stretch = mag(particle.pos - particles[spring.neighbor].pos) - spring.rest
-            Fspring = -spring.constant * stretch * norm(particle.pos - particles[spring.neighbor].pos)
-            forces.append(Fspring)
+        if particle.image is not None:
+            particle.update_method = UpdateMethod.MIRROR
+            continue
 
-        Fnet = vector(0, 0, 0)
-        for force in forces:
-            Fnet += force
-        Fnet *= DAMPING
+        Fnet = spring_force(particle, particles, out=particle.stored_force)
 
         calc_particle_pos = particle.pos + ((particle.momentum + (Fnet * dt)) / particle.mass * dt)
         calc_club_point = club.pos + club.velocity * dt
@@ -113,25 +315,28 @@ def determine_update_method(particles, club, dt, config):
         contact_threshold = particle.radius * CONTACT_TOLERANCE
 
         if actual < -contact_threshold:
-            particle.update_method = "club"
+            particle.update_method = UpdateMethod.CLUB
         else:
-            particle.update_method = "momentum"
-            particle.stored_force = Fnet
+            particle.update_method = UpdateMethod.MOMENTUM
 
 
 def animate_particles(particles, club, dt, config):
     """Animate all particles based on their update method."""
+    snapped = {}
     for particle in particles:
-        if config.debug and not (particle.update_method == "momentum" or particle.update_method == "club"):
-            raise AssertionError("particle update = " + particle.update_method)
+        if config.debug and particle.update_method == UpdateMethod.NONE:
+            raise AssertionError("particle update = " + particle.update_method.name)
 
-        if particle.update_method == "momentum":
+        if particle.update_method == UpdateMethod.MOMENTUM:
             update_momentum(particle, particle.stored_force, dt)
-        else:
-            update_club(particle, club)
+        elif particle.update_method == UpdateMethod.CLUB:
+            snapped[particle] = update_club(particle, club, particle.stored_force, dt)
+
+        particle.update_method = UpdateMethod.NONE
 
-        particle.update_method = ""
-        particle.stored_force = None
+    # mirrored particles follow their counterparts once those have moved
+    update_mirrors(particles)
+    credit_snaps(particles, club, snapped)
 
 
 def animate_club(club, dt):
@@ -141,6 +346,9 @@ def animate_club(club, dt):
 
 def draw_curves(particles, curves):
     """Update the position of each spring connection curve."""
+    if curves is None:
+        return curves
+
     for outer in range(len(particles)):
         particle = particles[outer]
 
@@ -155,6 +363,9 @@ def draw_curves(particles, curves):
 
 def animate_time(pos, time, t, dt, config):
     """Display the time in the upper left hand corner of the display."""
+    if time is None:
+        return
+
     time.text = "t = " + str(t + dt)
     time.pos = pos + vector(-config.ball_radius, 1.7 * config.ball_radius, -1.5 * config.ball_radius)
 
@@ -167,3 +378,233 @@ def animate(club, particles, curves, time, t, dt, config):
     animate_club(club, dt)
     animate_particles(particles, club, dt, config)
     draw_curves(particles, curves)
+
+
+def animate_multirate(club, particles, curves, time, t, dt, config):
+    """
+    Animate one coarse step made of config.substeps fine steps.
+
+    The stiff intra-shell springs and club contact are evaluated every fine
+    step dt, while the softer nested springs are evaluated once per coarse
+    step and applied as half kicks on either side of the subcycles (impulse
+    r-RESPA). Both ends of every spring are kicked at the same instant, so the
+    ball only exchanges momentum with the club.
+
+    Returns:
+        The coarse timestep that was taken
+    """
+    coarse = dt * config.substeps
+    animate_time(particles[-1].pos, time, t, coarse, config)
+
+    # mirrored particles only follow their counterparts
+    active = [particle for particle in particles if particle.image is None]
+
+    # forces are carried over from the end of the previous coarse step
+    for particle in active:
+        if particle.soft_force is None:
+            particle.soft_force = spring_force(particle, particles, Relation.NESTED)
+        if particle.stiff_force is None:
+            particle.stiff_force = spring_force(particle, particles, Relation.NEIGHBOR)
+
+    for particle in active:
+        particle.momentum += particle.soft_force * coarse / 2
+
+    free = []
+    for step in range(config.substeps):
+        # contact is decided on the fine step, as in determine_update_method
+        free = []
+        pinned = []
+        calc_club_point = club.pos + club.velocity * dt
+        for particle in active:
+            calc_particle_pos = particle.pos + ((particle.momentum + (particle.stiff_force * dt)) / particle.mass * dt)
+            actual = (dot(calc_particle_pos - calc_club_point, club.norm)) / mag(club.norm)
+            if actual < -particle.radius * CONTACT_TOLERANCE:
+                pinned.append(particle)
+            else:
+                free.append(particle)
+
+        animate_club(club, dt)
+        for particle in free:
+            update_momentum(particle, particle.stiff_force, dt)
+        snapped = {particle: update_club(particle, club, particle.stiff_force, dt) for particle in pinned}
+        update_mirrors(particles)
+        credit_snaps(particles, club, snapped)
+
+        for particle in active:
+            spring_force(particle, particles, Relation.NEIGHBOR, particle.stiff_force)
+
+    for particle in active:
+        spring_force(particle, particles, Relation.NESTED, particle.soft_force)
+
+    # particles held by the club keep its velocity, the club taking up their kick
+    for particle in free:
+        particle.momentum += particle.soft_force * coarse / 2
+        particle.velocity = particle.momentum / particle.mass
+    for particle in pinned:
+        kick = particle.soft_force * coarse / 2
+        credit_club(club, particle, -kick, -cross(particle.pos, kick),
+                    -dot(kick, particle.velocity) - mag2(kick) / (2 * particle.mass))
+    update_mirrors(particles)
+
+    draw_curves(particles, curves)
+
+    return coarse
+
+
+def animate_deformable(club, particles, curves, time, t, dt, config):
+    """Animate the particle model for one step, returning the timestep taken."""
+    if config.substeps > 1:
+        return animate_multirate(club, particles, curves, time, t, dt, config)
+
+    animate(club, particles, curves, time, t, dt, config)
+    return dt
+
+
+##################################################################
+## RIGID-BODY FLIGHT
+##################################################################
+
+def spring_energy(particles):
+    """Potential energy stored in the springs, with DAMPING folded into the constants."""
+    energy = 0
+    for particle in particles:
+        for spring in particle.springs:
+            stretch = mag(particle.pos - particles[spring.neighbor].pos) - spring.rest
+            energy += spring.constant * stretch ** 2
+
+    # every spring is stored once on each of the two particles it connects
+    return DAMPING * energy / 4
+
+
+def separated(particles, club, dt):
+    """Check whether the ball is moving away from the club and clear of its face after dt."""
+    momentum = vector(0, 0, 0)
+    total_mass = 0
+    for particle in particles:
+        momentum += particle.mass * particle.velocity
+        total_mass += particle.mass
+
+    if dot(momentum / total_mass - club.velocity, club.norm) <= 0:
+        return False
+
+    calc_club_point = club.pos + club.velocity * dt
+    for particle in particles:
+        calc_particle_pos = particle.pos + particle.velocity * dt
+        actual = (dot(calc_particle_pos - calc_club_point, club.norm)) / mag(club.norm)
+        if actual < particle.radius * CONTACT_TOLERANCE:
+            return False
+
+    return True
+
+
+def make_rigid(particles, keep_vibration):
+    """Collapse the particle model into a rigid body carrying its momentum and spin."""
+    com = vector(0, 0, 0)
+    velocity = vector(0, 0, 0)
+    total_mass = 0
+    for particle in particles:
+        com += particle.mass * particle.pos
+        velocity += particle.mass * particle.velocity
+        total_mass += particle.mass
+    com /= total_mass
+    velocity /= total_mass
+
+    # solve L = I * omega about the center of mass
+    offsets = [particle.pos - com for particle in particles]
+    spin = vector(0, 0, 0)
+    inertia = zeros((3, 3))
+    for particle, offset in zip(particles, offsets):
+        spin += particle.mass * cross(offset, particle.velocity - velocity)
+        r = array([offset.x, offset.y, offset.z])
+        inertia += particle.mass * (mag2(offset) * identity(3) - outer(r, r))
+    w = solve(inertia, array([spin.x, spin.y, spin.z]))
+    omega = vector(float(w[0]), float(w[1]), float(w[2]))
+
+    # whatever rigid motion does not explain is vibration
+    deviations = [particle.velocity - velocity - cross(omega, offset)
+                  for particle, offset in zip(particles, offsets)]
+    vibration_energy = spring_energy(particles)
+    for particle, deviation in zip(particles, deviations):
+        vibration_energy += particle.mass * mag2(deviation) / 2
+
+    if not keep_vibration:
+        deviations = [vector(0, 0, 0) for particle in particles]
+
+    return RigidBody(com, velocity, omega, total_mass, offsets, deviations, vibration_energy)
+
+
+def make_deformable(body, particles):
+    """Hand the rigid-body motion back to the particles, restoring any carried vibration."""
+    for particle, offset, deviation in zip(particles, body.offsets, body.deviations):
+        particle.velocity = body.velocity + cross(body.omega, offset) + deviation
+        particle.momentum = particle.mass * particle.velocity
+        particle.soft_force = None
+        particle.stiff_force = None
+
+
+def advance_rigid(body, particles, dt):
+    """Move and spin the rigid body, carrying the particles along with it.
+
+    The ball is nearly isotropic, so omega is held constant during free flight.
+    """
+    body.com += body.velocity * dt
+
+    angle = mag(body.omega) * dt
+    if angle != 0:
+        body.offsets = [offset.rotate(angle=angle, axis=body.omega) for offset in body.offsets]
+        body.deviations = [deviation.rotate(angle=angle, axis=body.omega) for deviation in body.deviations]
+
+    for particle, offset in zip(particles, body.offsets):
+        particle.pos = body.com + offset
+        particle.velocity = body.velocity + cross(body.omega, offset)
+        particle.momentum = particle.mass * particle.velocity
+
+
+def animate_rigid(club, particles, curves, body, time, t, dt, config):
+    """Animate all objects for one rigid-body timestep."""
+    animate_time(particles[-1].pos, time, t, dt, config)
+
+    animate_club(club, dt)
+    advance_rigid(body, particles, dt)
+    draw_curves(particles, curves)
+
+
+def animate_hybrid(club, particles, curves, hybrid, time, t, dt, config):
+    """
+    Animate one step, switching to a rigid body while the ball is clear of the club.
+
+    Args:
+        hybrid: Dict with the current rigid 'body' (None while deformable) and
+            the number of consecutive contact-free 'free_steps'
+
+    Returns:
+        The timestep that was taken
+    """
+    if not config.rigid:
+        return animate_deformable(club, particles, curves, time, t, dt, config)
+
+    body = hybrid['body']
+    if body is not None:
+        if separated(particles, club, RIGID_TIMESTEP):
+            animate_rigid(club, particles, curves, body, time, t, RIGID_TIMESTEP, config)
+            return RIGID_TIMESTEP
+
+        make_deformable(body, particles)
+        hybrid['body'] = None
+        hybrid['free_steps'] = 0
+        if config.debug:
+            print("contact recurred, restoring particle model")
+
+    step = animate_deformable(club, particles, curves, time, t, dt, config)
+
+    if separated(particles, club, step):
+        hybrid['free_steps'] += 1
+    else:
+        hybrid['free_steps'] = 0
+
+    if hybrid['free_steps'] >= SEPARATION_STEPS:
+        hybrid['body'] = make_rigid(particles, config.keep_vibration)
+        if config.debug:
+            print("ball separated with vibration energy " + str(hybrid['body'].vibration_energy))
+
+    return step
@@ -64,7 +64,8 @@ def plot(particles, centers, changes, omegas, last_vec, t, dt, graphs):
         last_vec: Previous direction vector for spin calculation
         t: Current time
         dt: Time step
-        graphs: Dict with 'v_com', 'spin', 'v_center' gdots objects
+        graphs: Dict with 'v_com', 'spin', 'v_center' gdots objects, or None
+            to only track the data
 
     Returns:
         Dict with rcom, vcom, current_vec, changes, omegas
@@ -85,7 +86,8 @@ def plot(particles, centers, changes, omegas, last_vec, t, dt, graphs):
         omega = dtheta / dt
         omegas = append(omegas, omega)
         last_vec = current_vec
-        graphs['spin'].plot(pos=(t, omega))
+        if graphs is not None:
+            graphs['spin'].plot(pos=(t, omega))
 
     # Velocity plotting
     centers.append(center.velocity)
@@ -95,8 +97,9 @@ def plot(particles, centers, changes, omegas, last_vec, t, dt, graphs):
         if change_in_sign(old_slope, slope):
             changes = append(changes, t)
 
-    graphs['v_com'].plot(pos=(t, mag(vcom)))
-    graphs['v_center'].plot(pos=(t, mag(center.velocity)))
+    if graphs is not None:
+        graphs['v_com'].plot(pos=(t, mag(vcom)))
+        graphs['v_center'].plot(pos=(t, mag(center.velocity)))
 
     return {
         'rcom': rcom,
@@ -6,23 +6,27 @@
 ##################################################################
 
 from vpython import *
-from numpy import array, append, empty, ediff1d, average
+from numpy import array, append, empty, ediff1d, average, flatnonzero, cross as cross3
 
 from config import create_config
 from constants import (
     PLAY_STROKE, STEP_STROKE, BREAK_STROKE,
     PARTICLE_V0, TIMESTEP,
-    SHAPE, GEO_M, GEO_N,
+    SHAPE, VERTS, GEO_M, GEO_N, NEIGHBOR_TOLERANCE,
     SCENE_BACKGROUND, SCENE_FOREGROUND,
     CLUB_COLOR,
 )
-from models import Particle, Club
+from models import Particle, Club, Marker, Relation
 from geodesic import make_sphere
 from physics import (
-    connect_layers, connect_neighbors, get_club_plane,
-    animate, draw_curves,
+    connect_layers, connect_neighbors, connect_patch_neighbors, scale_patch, get_club_plane,
+    make_symmetric,
+    animate_hybrid, draw_curves,
 )
 from plotting import setup_graphs, plot
+from diagnostics import ConservationMonitor
+from export import VTKExporter
+from recording import RunRecorder
 
 ##################################################################
 ## SCENE SETUP
@@ -41,16 +45,16 @@ def setup_scene(config):
 ## INITIALIZATIONS
 ##################################################################
 
-def draw_sphere(points, particle_color, config):
-    """Create Particle objects from points array."""
+def draw_sphere(points, particle_color, config, visual=sphere):
+    """Create Particle objects from points array, drawn with the visual factory."""
     particles = []
 
     for i in range(points.shape[0]):
         point = points[i]
-        visual = sphere(radius=config.particle_radius,
-                        pos=vector(point[0], point[1], point[2]),
-                        color=particle_color)
-        particle = Particle(visual, PARTICLE_V0, config.particle_mass)
+        particle_visual = visual(radius=config.particle_radius,
+                                 pos=vector(point[0], point[1], point[2]),
+                                 color=particle_color)
+        particle = Particle(particle_visual, PARTICLE_V0, config.particle_mass)
         particles.append(particle)
 
     return particles
@@ -65,8 +69,159 @@ def get_properties(config):
     }
 
 
-def make_model(config):
-    """Create the particle-spring model."""
+def get_patch_direction(config):
+    """Get the unit vector from the center of the ball toward the club face."""
+    club = Club(Marker(pos=config.club_r0), config.club_v0)
+    get_club_plane(club, config)
+    return -norm(club.norm)
+
+
+def distance(first, second):
+    """Distance between two points of a points array."""
+    return ((first - second) ** 2).sum() ** 0.5
+
+
+def shell_threshold(points):
+    """Neighbor threshold of a uniform shell, as connect_neighbors computes it."""
+    if len(points) > 14:
+        return distance(points[VERTS + 1], points[VERTS]) * NEIGHBOR_TOLERANCE
+    return distance(points[5], points[4]) * NEIGHBOR_TOLERANCE
+
+
+def holds_shorter_diagonal(points, triangle, other):
+    """Whether a triangle of a flat quad with other holds the quad's shorter diagonal."""
+    i, j, k = triangle
+    pairings = [((i, j), (k, other)), ((i, k), (j, other)), ((j, k), (i, other))]
+
+    # the diagonals of a convex quad are longer together than either pair of opposite sides
+    inside, across = max(pairings, key=lambda pairing: sum(distance(points[a], points[b]) for a, b in pairing))
+    return (distance(points[inside[0]], points[inside[1]]), sorted(inside)) \
+        < (distance(points[across[0]], points[across[1]]), sorted(across))
+
+
+def shell_triangles(points, threshold, chunk=256):
+    """
+    Triangulate a shell of points on a sphere.
+
+    A triangle of points within threshold of each other is a face of the
+    shell's convex hull when no other point lies beyond its plane. Where four
+    points share a plane, only the two triangles on its shorter diagonal are kept.
+    Candidate triangles are tested against every point chunk at a time.
+
+    Returns:
+        List of (i, j, k) index triples, and the area of each triangle
+    """
+    count = len(points)
+    near = (((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2) ** 0.5) < threshold
+    near[range(count), range(count)] = False
+    tolerance = 1e-9 * threshold
+
+    candidates = array([(i, j, k) for i in range(count) for j in flatnonzero(near[i]) if j > i
+                        for k in flatnonzero(near[i] & near[j]) if k > j], dtype=int).reshape(-1, 3)
+    corners = points[candidates[:, 0]]
+    normals = cross3(points[candidates[:, 1]] - corners, points[candidates[:, 2]] - corners)
+    normals[(normals * corners).sum(axis=1) < 0] *= -1
+    sizes = (normals ** 2).sum(axis=1) ** 0.5
+    offsets = (normals * corners).sum(axis=1)
+
+    triangles = []
+    areas = []
+    for start in range(0, len(candidates), chunk):
+        heights = normals[start:start + chunk] @ points.T - offsets[start:start + chunk, None]
+        limits = tolerance * sizes[start:start + chunk]
+        for face in flatnonzero(~(heights > limits[:, None]).any(axis=1)):
+            (i, j, k), height, size = candidates[start + face], heights[face], sizes[start + face]
+            flat = [other for other in flatnonzero(abs(height) <= tolerance * size) if other not in (i, j, k)]
+            if len(flat) == 1 and not holds_shorter_diagonal(points, (i, j, k), flat[0]):
+                continue
+            triangles.append((int(i), int(j), int(k)))
+            areas.append(size / 2)
+
+    return triangles, areas
+
+
+def point_areas(points, threshold):
+    """Area each point of a shell stands for: a third of the triangles around it."""
+    triangles, triangle_areas = shell_triangles(points, threshold)
+    areas = [0] * len(points)
+    for triangle, area in zip(triangles, triangle_areas):
+        for index in triangle:
+            areas[index] += area / 3
+
+    return triangles, areas
+
+
+def make_patch_shell(freq, config):
+    """
+    Make a shell that is config.refine times finer where it faces the club.
+
+    The icosahedron vertices come first, as in a uniform shell, followed by
+    the coarse points outside the patch and the fine points inside it.
+
+    The shell is connected along its triangulation, so the seam between the
+    coarse and fine points is neither over- nor under-connected. Each point's
+    weight is the share of the shell a point of its uniform shell carries,
+    scaled by how much more or less area it covers here than there, so only
+    the points along the seam differ from the uniform weights.
+
+    Returns:
+        Dict with points, fine flags, the neighbor pairs to connect, the
+        weight of each point, the uniform coarse points and the coarse spacing
+    """
+    radius = config.get_piece_radii()[0]
+    coarse = make_sphere(SHAPE, freq, GEO_M, GEO_N) * radius
+    fine = make_sphere(SHAPE, freq * config.refine, GEO_M, GEO_N) * radius
+    fine_threshold = shell_threshold(fine)
+    coarse_areas = point_areas(coarse, shell_threshold(coarse))[1]
+    fine_areas = point_areas(fine, fine_threshold)[1]
+
+    direction = get_patch_direction(config)
+    center = array([direction.x, direction.y, direction.z])
+    limit = cos(radians(config.patch_angle))
+
+    def in_patch(point):
+        return (point * center).sum() / radius >= limit
+
+    # each point's area in its uniform shell, in units of a uniform coarse point's
+    points = [coarse[i] for i in range(VERTS)]
+    flags = [in_patch(point) for point in points]
+    uniform = [(fine_areas[i] if flag else coarse_areas[i]) * len(coarse) / sum(coarse_areas)
+               for i, flag in enumerate(flags)]
+    shares = [len(coarse) / len(fine) if flag else 1.0 for flag in flags]
+    for i in range(VERTS, len(coarse)):
+        if not in_patch(coarse[i]):
+            points.append(coarse[i])
+            flags.append(False)
+            uniform.append(coarse_areas[i] * len(coarse) / sum(coarse_areas))
+            shares.append(1.0)
+
+    # fine points that land on a kept coarse point at the seam are dropped
+    kept = array(points)
+    gaps = (((fine[:, None, :] - kept[None, :, :]) ** 2).sum(axis=2) ** 0.5).min(axis=1)
+    for i in range(VERTS, len(fine)):
+        if in_patch(fine[i]) and gaps[i] > fine_threshold / 4:
+            points.append(fine[i])
+            flags.append(True)
+            uniform.append(fine_areas[i] * len(coarse) / sum(coarse_areas))
+            shares.append(len(coarse) / len(fine))
+
+    points = array(points)
+    triangles, areas = point_areas(points, shell_threshold(coarse))
+    areas = [area * len(coarse) / sum(coarse_areas) for area in areas]
+    weights = [share * area / area_uniform for share, area, area_uniform in zip(shares, areas, uniform)]
+
+    return {
+        'points': points,
+        'fine': flags,
+        'edges': sorted(set((a, b) for i, j, k in triangles for a, b in ((i, j), (i, k), (j, k)))),
+        'weights': [float(weight * len(coarse) / sum(weights)) for weight in weights],
+        'coarse': coarse,
+        'coarse_spacing': float(shell_threshold(coarse) / NEIGHBOR_TOLERANCE),
+    }
+
+
+def make_model(config, visual=sphere):
+    """Create the particle-spring model, drawing particles with the visual factory."""
     freq = 2**(config.layers - 2)
 
     properties = get_properties(config)
@@ -81,24 +236,37 @@ def make_model(config):
     points = empty(shape=(0, 3))
     particles = []
     layers = [0]
+    patch = None
 
     while freq >= 1:
         if config.debug:
             print("Layer " + str(counter) + " with freq " + str(int(freq)))
 
-        new_points = make_sphere(SHAPE, int(freq), GEO_M, GEO_N)
-        new_points *= scales[counter]
+        if counter == 0 and config.refine > 1:
+            patch = make_patch_shell(int(freq), config)
+            new_points = patch['points']
+        else:
+            new_points = make_sphere(SHAPE, int(freq), GEO_M, GEO_N)
+            new_points *= scales[counter]
         points = append(points, new_points, axis=0)
 
-        new_particles = draw_sphere(new_points, colors[counter], config)
+        new_particles = draw_sphere(new_points, colors[counter], config, visual)
         particles.extend(new_particles)
 
         layers.append(layers[-1] + len(new_particles))
 
-        connect_neighbors(particles, layers[counter], neighbor_modulus[neighbor_counter], config)
+        if counter == 0 and patch is not None:
+            connect_patch_neighbors(particles, layers[counter], patch, neighbor_modulus[neighbor_counter], config)
+        else:
+            connect_neighbors(particles, layers[counter], neighbor_modulus[neighbor_counter], config)
         neighbor_counter += 1
         if counter > 0:
-            connect_layers(particles, layers, layer_modulus[layer_counter], config)
+            # the refined shell no longer has a uniform layout, so measure its uniform counterpart
+            threshold = None
+            if counter == 1 and patch is not None:
+                outer = patch['coarse'][VERTS] if len(new_points) >= VERTS else patch['coarse'][0]
+                threshold = distance(outer, new_points[0]) * NEIGHBOR_TOLERANCE
+            connect_layers(particles, layers, layer_modulus[layer_counter], config, threshold)
             layer_counter += 1
 
         if freq == 1:
@@ -109,11 +277,14 @@ def make_model(config):
 
     # last iteration for freq == -1 (single point) is a special case
     new_points = array([[0., 0., 0.]])
-    new_particles = draw_sphere(new_points, colors[counter], config)
+    new_particles = draw_sphere(new_points, colors[counter], config, visual)
     particles.extend(new_particles)
     layers.append(layers[-1] + len(new_particles))
     connect_layers(particles, layers, layer_modulus[layer_counter], config)
 
+    if patch is not None:
+        scale_patch(particles, 0, patch, config)
+
     return particles
 
 
@@ -127,7 +298,7 @@ def make_curves(particles, config):
 
         for spring in particle.springs:
             curve_color = color.magenta
-            if spring.relation == "neighbor":
+            if spring.relation == Relation.NEIGHBOR:
                 curve_color = particle.color
 
             curves[outer].append(curve(pos=[particle.pos, particles[spring.neighbor].pos],
@@ -143,6 +314,8 @@ def reset(config):
                       color=CLUB_COLOR, pos=config.club_r0)
     club = Club(club_visual, config.club_v0)
     get_club_plane(club, config)
+    if config.symmetric and not make_symmetric(particles, club, config):
+        print("impact is not symmetric about z = 0, simulating the full ball")
     curves = make_curves(particles, config)
 
     return {
@@ -184,6 +357,28 @@ def main_loop():
     omegas = array([])
     last_vec = vector(0, 0, 0)
 
+    # Rigid-body state once the ball leaves the club face
+    hybrid = {'body': None, 'free_steps': 0}
+
+    # Energy and momentum budgets
+    monitor = None
+    monitor_stream = None
+    if config.monitor > 0:
+        if config.monitor_file is not None:
+            monitor_stream = open(config.monitor_file, "w")
+        monitor = ConservationMonitor(particles, config.monitor, monitor_stream,
+                                      config.energy_alarm, config.momentum_alarm)
+
+    # VTK time series for offline playback
+    exporter = None
+    if config.export is not None:
+        exporter = VTKExporter(config.export, particles, config.export_stride)
+
+    # Raw particle states for out-of-core analysis
+    recorder = None
+    if config.record is not None:
+        recorder = RunRecorder(config.record, particles, club, config.record_stride, config)
+
     # Set loop variables
     running = not config.debug
     last_stroke = ""
@@ -213,13 +408,19 @@ def main_loop():
 
         if running:
             scene.center = particles[-1].pos
-            animate(club, particles, curves, time, t, dt, config)
-
-            plot_info = plot(particles, centers, changes, omegas, last_vec, t, dt, graphs)
+            step = animate_hybrid(club, particles, curves, hybrid, time, t, dt, config)
+            if monitor is not None:
+                monitor.sample(particles, club, t + step)
+            if exporter is not None:
+                exporter.write(particles, t + step)
+            if recorder is not None:
+                recorder.write(particles, t + step, step)
+
+            plot_info = plot(particles, centers, changes, omegas, last_vec, t, step, graphs)
             last_vec = plot_info['current_vec']
             changes = plot_info['changes']
             omegas = plot_info['omegas']
-            t += dt
+            t += step
 
             if last_stroke == STEP_STROKE:
                 print("step complete", end="\n\n")
@@ -230,13 +431,24 @@ def main_loop():
 
             last_stroke = ""
 
+    if monitor_stream is not None:
+        monitor_stream.close()
+    if exporter is not None:
+        exporter.close()
+    if recorder is not None:
+        recorder.close()
+
     # Post processing
     collision = changes[1] - changes[0]
     remove_first = changes[1:]
     diffs = ediff1d(remove_first)
     print("collision is " + str(collision) + " average of diffs is " + str(average(diffs)))
     print("velocity is " + str(plot_info['vcom']))
-    print("omega is " + str(average(omegas)))
+    if hybrid['body'] is not None:
+        # the rigid body carries the spin once the particle tracking stops
+        print("omega is " + str(hybrid['body'].omega.z))
+    else:
+        print("omega is " + str(average(omegas)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+##################################################################
+## RECORDING - store runs on disk for out-of-core analysis
+##################################################################
+
+import json
+import os
+
+from numpy import array, memmap, float64
+
+from cache import get_settings
+from diagnostics import get_state
+
+META_NAME = "meta.json"
+TIMES_NAME = "times.f8"
+STEPS_NAME = "steps.f8"
+POSITIONS_NAME = "positions.f8"
+VELOCITIES_NAME = "velocities.f8"
+
+
+class RunRecorder:
+    """
+    Append the particle state of a run to raw float64 files every stride steps.
+
+    Each frame holds the time after the step that produced it and the size of
+    that step, since the step varies once the ball flies as a rigid body.
+    Frames are appended as they come, so a run can be read while it is still
+    being recorded or after it was cut short. The frame count is taken from
+    the size of the times file, written last, rather than from the metadata.
+    """
+
+    def __init__(self, directory, particles, club, stride, config):
+        self.stride = stride
+        self.steps = 0
+        os.makedirs(directory, exist_ok=True)
+
+        meta = {
+            'particles': len(particles),
+            'masses': [particle.mass for particle in particles],
+            'center': len(particles) - 1,
+            'edge': 11,
+            'club_norm': [club.norm.x, club.norm.y, club.norm.z],
+            'stride': stride,
+            'settings': get_settings(config),
+        }
+        with open(os.path.join(directory, META_NAME), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+        self.times = open(os.path.join(directory, TIMES_NAME), "wb")
+        self.step_sizes = open(os.path.join(directory, STEPS_NAME), "wb")
+        self.positions = open(os.path.join(directory, POSITIONS_NAME), "wb")
+        self.velocities = open(os.path.join(directory, VELOCITIES_NAME), "wb")
+
+    def write(self, particles, t, step):
+        """Record one step of size step that ended at t, appending a frame every stride steps."""
+        self.steps += 1
+        if (self.steps - 1) % self.stride != 0:
+            return
+
+        positions, velocities = get_state(particles)
+        self.positions.write(positions.astype(float64).tobytes())
+        self.velocities.write(velocities.astype(float64).tobytes())
+        self.step_sizes.write(array([step], dtype=float64).tobytes())
+        self.times.write(array([t], dtype=float64).tobytes())
+
+    def close(self):
+        for stream in (self.times, self.step_sizes, self.positions, self.velocities):
+            stream.close()
+
+
+def open_run(directory):
+    """
+    Open a recorded run without loading it.
+
+    Returns:
+        Dict with meta, and times and steps [frames], positions and
+        velocities [frames, particles, 3] as read-only memory maps
+    """
+    with open(os.path.join(directory, META_NAME)) as meta_file:
+        meta = json.load(meta_file)
+
+    count = meta['particles']
+    frames = os.path.getsize(os.path.join(directory, TIMES_NAME)) // 8
+    if frames == 0:
+        return {'meta': meta, 'times': array([]), 'steps': array([]), 'positions': None, 'velocities': None}
+
+    def open_array(name, shape):
+        return memmap(os.path.join(directory, name), dtype=float64, mode="r", shape=shape)
+
+    return {
+        'meta': meta,
+        'times': open_array(TIMES_NAME, (frames,)),
+        'steps': open_array(STEPS_NAME, (frames,)),
+        'positions': open_array(POSITIONS_NAME, (frames, count, 3)),
+        'velocities': open_array(VELOCITIES_NAME, (frames, count, 3)),
+    }
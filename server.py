@@ -0,0 +1,259 @@
+##################################################################
+## JOB SERVER - queue headless impacts behind a local socket
+##################################################################
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import isfinite
+
+from cache import ResultCache, config_key
+from constants import CACHE_DIR, SERVER_PORT, DEFAULT_NEIGHBOR_MODULUS, MAX_SUBSTEPS
+from headless import headless_config, run_impact
+
+# job settings accepted from clients, with their types
+JOB_SETTINGS = {
+    'club_velocity': float,
+    'loft': float,
+    'pieces': int,
+    'rigid': bool,
+    'keep_vibration': bool,
+    'substeps': int,
+    'refine': int,
+    'patch_angle': float,
+    'symmetric': bool,
+}
+
+# JSON types each setting type accepts; bool is excluded from the numbers
+JSON_TYPES = {
+    float: ((int, float), "number"),
+    int: ((int,), "integer"),
+    bool: ((bool,), "boolean"),
+}
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+def run_job(key, settings, progress):
+    """Run one impact in a worker process, reporting progress to the server."""
+    config = headless_config(**settings)
+    return run_impact(config, progress=lambda fraction: progress.put((key, fraction)))
+
+
+def parse_settings(body):
+    """Validate a JSON job body into Config overrides."""
+    settings = json.loads(body or b"{}")
+    if not isinstance(settings, dict):
+        raise ValueError("job must be a JSON object")
+
+    unknown = set(settings) - set(JOB_SETTINGS)
+    if unknown:
+        raise ValueError("unknown settings: " + ", ".join(sorted(unknown)))
+
+    for name, value in settings.items():
+        types, type_name = JSON_TYPES[JOB_SETTINGS[name]]
+        if not isinstance(value, types) or (isinstance(value, bool) and JOB_SETTINGS[name] is not bool):
+            raise ValueError(name + " must be a JSON " + type_name)
+        # json reads NaN and Infinity, and overflows 1e400 to infinity
+        if not isfinite(value):
+            raise ValueError(name + " must be finite")
+
+    settings = {name: JOB_SETTINGS[name](value) for name, value in settings.items()}
+    if not 1 <= settings.get('pieces', 1) <= len(DEFAULT_NEIGHBOR_MODULUS):
+        raise ValueError("pieces must be between 1 and " + str(len(DEFAULT_NEIGHBOR_MODULUS)))
+    if not 1 <= settings.get('substeps', 1) <= MAX_SUBSTEPS:
+        raise ValueError("substeps must be between 1 and " + str(MAX_SUBSTEPS))
+    if settings.get('refine', 1) < 1:
+        raise ValueError("refine must be at least 1")
+
+    return settings
+
+
+class JobServer:
+    """
+    Run impact jobs on a process pool.
+
+    Identical jobs share one run while it is in flight, and finished results
+    are kept in a ResultCache so repeated requests are answered without
+    running the simulation again.
+    """
+
+    def __init__(self, workers, cache):
+        # spawned workers start from a fresh interpreter, so they never hold on
+        # to the listening socket or a client connection the way forked ones would
+        context = multiprocessing.get_context("spawn")
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.manager = context.Manager()
+        self.progress = self.manager.Queue()
+        self.cache = cache
+        self.jobs = {}  # key -> list of listener queues
+
+    async def submit(self, settings):
+        """Yield events for one job: queued, progress fractions, then the result or error."""
+        config = headless_config(**settings)
+        key = config_key(config)
+
+        result = self.cache.get(key)
+        if result is not None:
+            yield {'key': key, 'cached': True, 'result': result}
+            return
+
+        listener = asyncio.Queue()
+        if key in self.jobs:
+            self.jobs[key].append(listener)
+            yield {'key': key, 'status': "joined"}
+        else:
+            self.jobs[key] = [listener]
+            future = asyncio.get_running_loop().run_in_executor(self.pool, run_job, key, settings, self.progress)
+            future.add_done_callback(lambda done: self.finish(key, config, done))
+            yield {'key': key, 'status': "queued"}
+
+        while True:
+            event = await listener.get()
+            yield event
+            if 'result' in event or 'error' in event:
+                return
+
+    def finish(self, key, config, future):
+        """Cache a finished job and hand its result to every waiting client."""
+        listeners = self.jobs.pop(key)
+
+        if future.cancelled():
+            event = {'key': key, 'error': "cancelled"}
+        elif future.exception() is not None:
+            event = {'key': key, 'error': str(future.exception())}
+        else:
+            self.cache.put(key, config, future.result())
+            event = {'key': key, 'cached': False, 'result': future.result()}
+
+        for listener in listeners:
+            listener.put_nowait(event)
+
+    async def forward_progress(self):
+        """Forward progress reported by the workers to the clients of each job."""
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.progress.get)
+            if message is None:
+                return
+
+            key, fraction = message
+            for listener in self.jobs.get(key, []):
+                listener.put_nowait({'key': key, 'progress': fraction})
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+
+    async def handle(self, reader, writer):
+        """Serve one HTTP request: POST /jobs with a JSON body of job settings."""
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode()
+                if line.strip() == "":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if path.rstrip("/") != "/jobs":
+                await respond(writer, 404, [{'error': "unknown path " + path}])
+            elif method != "POST":
+                await respond(writer, 405, [{'error': "jobs are submitted with POST"}])
+            else:
+                await respond(writer, 200, self.submit(parse_settings(body)))
+
+        except (ValueError, TypeError, asyncio.IncompleteReadError) as error:
+            await respond(writer, 400, [{'error': str(error)}])
+
+        finally:
+            writer.close()
+
+
+async def respond(writer, status, events):
+    """Stream events to the client as newline-delimited JSON."""
+    writer.write(("HTTP/1.1 " + str(status) + " " + STATUS_TEXT[status] + "\r\n"
+                  + "Content-Type: application/x-ndjson\r\n"
+                  + "Connection: close\r\n\r\n").encode())
+
+    if hasattr(events, "__aiter__"):
+        async for event in events:
+            writer.write((json.dumps(event) + "\n").encode())
+            await writer.drain()
+    else:
+        for event in events:
+            writer.write((json.dumps(event) + "\n").encode())
+        await writer.drain()
+
+
+async def serve(args):
+    """Listen for jobs until interrupted."""
+    jobs = JobServer(args.workers, ResultCache(args.cache_dir))
+
+    if args.socket is not None:
+        server = await asyncio.start_unix_server(jobs.handle, path=args.socket)
+        print("serving jobs on " + args.socket)
+    else:
+        server = await asyncio.start_server(jobs.handle, args.host, args.port)
+        print("serving jobs on http://" + args.host + ":" + str(args.port) + "/jobs")
+
+    forwarding = asyncio.create_task(jobs.forward_progress())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        jobs.progress.put(None)
+        await forwarding
+        jobs.shutdown()
+
+
+def parse_server_args():
+    """Parse command-line arguments for the job server."""
+    parser = argparse.ArgumentParser(
+        description="Local job server for headless golf ball impacts",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--socket",
+        type=str, default=None,
+        help="Listen on this UNIX socket instead of TCP"
+    )
+    parser.add_argument(
+        "--host",
+        type=str, default="127.0.0.1",
+        help="TCP address to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int, default=SERVER_PORT,
+        help="TCP port to listen on"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int, default=os.cpu_count(),
+        help="Number of simulation worker processes"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str, default=CACHE_DIR,
+        help="Directory of cached results"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(parse_server_args()))
+    except KeyboardInterrupt:
+        pass